@@ -10,17 +10,47 @@
 # I hope you can gain some inspiration for it with your project / data / interests! <3
 
 # Import libraries
+# startup goes first so its timeline also covers the time spent importing everything else
+from startup import fast_start, lazy_import, timeline
+import json
+import os
+import sys
+import threading
+import time
 import dash as dash
 from dash import dcc
 from dash import html
-from dash import ctx
+from dash import ctx, no_update
+from dash.exceptions import PreventUpdate
 from textwrap import dedent
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import plotly.graph_objects as go
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from flask import Response, abort, request
 
 import numpy as np
 import pandas as pd
-import plotly.express as px
+# plotly.express alone takes about half a second to import, in fast-start mode that happens on first use
+px = lazy_import("plotly.express")
+
+from cache import FigureCache, file_signature
+from coalesce import ClickTracker, Superseded
+from columnar import cached_table
+from compression import ResponseCompressor, compress, content_etag, pick_encoding
+from crossfilter import SliceCache, copy_patch, treemap_stations
+from cube import EventCube
+from datasets import DatasetRegistry
+from shared_cache import SharedFigureStore
+from timeindex import EventTimeIndex
+from features import add_event_features
+from filters import EventFilterIndex, describe, filter_key, normalize_filters
+from metrics import CallbackMetrics, MetricsRegistry
+from profiling import profiled
+from figures import build_aggregated_histogram, build_density_heatmap, build_event_treemap, build_station_map, \
+    nice_bin_edges, treemap_midpoint
+
+timeline.mark("imports")
 
 # Figure Templates
 bgcolor = "#f3f3f1"  # mapbox light map land color
@@ -31,31 +61,69 @@ template = {"layout": {"paper_bgcolor": bgcolor, "plot_bgcolor": bgcolor}}
 app = dash.Dash(__name__)
 server = app.server
 
-
-# helper function to update season
-def get_season(trimmed_date):
-    month = int(trimmed_date[0:2])
-    day = int(trimmed_date[3:5])
-
-    # Define the start day of each season
-    spring_start = 20
-    summer_start = 21
-    autumn_start = 22
-    winter_start = 21
-
-    if month == 3 and day >= spring_start or month == 4 or month == 5 or (month == 6 and day < summer_start):
-        return 'Spring'
-    elif month == 6 and day >= summer_start or month == 7 or month == 8 or (month == 9 and day < autumn_start):
-        return 'Summer'
-    elif month == 9 and day >= autumn_start or month == 10 or month == 11 or (month == 12 and day < winter_start):
-        return 'Autumn'
-    else:
-        return 'Winter'
-
-
-# Define a helper function to map labels to groups
-def map_label_to_group(label):
-    return label_to_group[label]
+callback_path = app.config.routes_pathname_prefix + "_dash-update-component"
+
+# latency, size and cache numbers on /metrics, see metrics.py
+# METRICS_DIR is a folder where the gunicorn workers pool their numbers (gunicorn.conf.py sets it)
+metrics_registry = MetricsRegistry(os.environ.get("METRICS_DIR"))
+callback_metrics = CallbackMetrics(metrics_registry, [callback_path])
+callback_metrics.init_app(server)
+
+# callback responses are compressed, the cached figures only once (kept with them), see compression.py
+response_compressor = ResponseCompressor([callback_path])
+response_compressor.init_app(server)
+
+# Built figures for each dataset and graph, see cache.py
+# behind it sits a store on disk shared by all the gunicorn workers (see shared_cache.py),
+# so a figure is built once per server instead of once per worker. SHARED_CACHE=0 turns it off
+# it is kept out of assets/, which dash serves to anyone
+shared_cache_dir = os.environ.get("SHARED_CACHE_DIR", os.path.join(".cache", "figures"))
+figure_store = SharedFigureStore(shared_cache_dir) if os.environ.get("SHARED_CACHE", "1") != "0" else None
+figure_cache = FigureCache(shared=figure_store)  # sized further down, from the figures warmup() builds
+# the St. Lawrence figures for one combination of filters get their own, smaller cache: there are far too
+# many combinations to keep them on disk, and a burst of them shouldn't push the dataset figures out above
+filtered_cache = FigureCache(maxsize=64)
+
+metrics_registry.describe("cache_requests_total", "counter", "Lookups in the in-process caches by result")
+metrics_registry.collect(lambda: [
+    ("cache_requests_total", {"cache": "figures", "result": "hit"}, figure_cache.hits),
+    ("cache_requests_total", {"cache": "figures", "result": "miss"}, figure_cache.misses),
+    ("cache_requests_total", {"cache": "filtered_figures", "result": "hit"}, filtered_cache.hits),
+    ("cache_requests_total", {"cache": "filtered_figures", "result": "miss"}, filtered_cache.misses),
+    ("cache_requests_total", {"cache": "compressed", "result": "hit"}, response_compressor.hits),
+    ("cache_requests_total", {"cache": "compressed", "result": "miss"}, response_compressor.misses),
+])
+
+# Tables behind each dataset, loaded on first use, see datasets.py
+datasets = DatasetRegistry()
+
+# the graphs every dataset fills, one callback each
+graph_ids = ["histo", "dense", "main", "pie", "scatter"]
+# the dataset buttons, in the order update_graph takes them
+dataset_ids = ["mxmh", "can", "whd19", "whd"]
+
+# YEAR_SLIDER=1 shows the multi-year World Happiness figures one year at a time, picked with a slider,
+# instead of sending every year's animation frames at once
+year_slider = os.environ.get("YEAR_SLIDER", "0") == "1"
+# the graphs that animate over years in the whd dataset
+animated_graphs = ["histo", "main", "scatter"]
+
+# PREFETCH_FIGURES=1 sends every dataset's figures to the browser once (after the page has loaded)
+# and switches datasets there, so repeat clicks never reach the server. see assets/figure_bundle.js
+prefetch_figures = os.environ.get("PREFETCH_FIGURES", "0") == "1"
+# the bundles hold whole animations, so the year slider is only used when figures come from the server
+year_slider = year_slider and not prefetch_figures
+
+
+# number of figures warmup() builds: every graph of every dataset, plus each year of the animated graphs
+def warm_figure_count(years=()):
+    return len(dataset_ids) * len(graph_ids) + len(years) * len(animated_graphs)
+
+
+# the figure cache holds all of them with room to spare for drilled treemaps, so none is evicted before
+# gunicorn forks the workers. warmup() makes room for the years once it knows them (year slider only)
+figure_cache_spare = 16
+figure_cache.resize(warm_figure_count() + figure_cache_spare)
 
 
 # this is a template modal that makes the info help text work
@@ -99,11 +167,6 @@ def build_modal_info_overlay(id, side, content):
     return div
 
 
-# import all data for figures below
-# this is from the starting dataset
-localdf = pd.read_csv("assets/peakdatemodified_wl_local_event_stats.csv")
-lookup = pd.read_csv("assets/station_data.csv")
-
 # Define the order of seasons
 season_order = ['Spring', 'Summer', 'Autumn', 'Winter']
 
@@ -179,24 +242,6 @@ labs = [
 # Create a mapping of location to color
 location_colors = dict(zip(locations, monochromatics))
 
-# Data preprocessing
-
-# Trim date
-localdf['trimmed_date'] = localdf['date_start'].str[0:5]
-
-# Map trimmed date to season and create a new column
-localdf['season'] = localdf['trimmed_date'].apply(get_season)
-
-# Group by 'season' and count the number of rows in each group
-season_counts = localdf['season'].value_counts().rename(localdf['station_name']).reindex(
-    season_order)  # Use filename as column name
-
-# Group by 'station_name' and 'season', and count the number of observations
-season_counts = localdf.groupby(['station_name', 'season']).size().unstack(fill_value=0)
-
-# Make new column for days out of duration
-localdf['days'] = localdf['duration'] / 24
-
 # Define mapping of labels to groups
 label_to_group = {
     'ptc': 1, 'mtr': 1,
@@ -205,137 +250,220 @@ label_to_group = {
     'lau': 4, 'slio': 4, 'sjr': 4, 'rim': 4, 'sep': 4
 }
 
-# Apply function to create the 'domain' column
-localdf['domain'] = localdf['stn_lab'].apply(lambda x: map_label_to_group(x))
-
-# Calculate standardization for 'max' column
-localdf['max_std'] = localdf['max'].apply(lambda x: (x - localdf['max'].mean()) / localdf['max'].std(ddof=0))
+# Create a dictionary to map each location to its rank
+location_rank = {location: rank + 1 for rank, location in enumerate(locations)}
 
-# Calculate standardization for 'min' column
-localdf['days_std'] = localdf['days'].apply(lambda x: (x - localdf['days'].mean()) / localdf['days'].std(ddof=0))
+# bump this whenever the preprocessing below changes, it invalidates the columnar cache
+preprocess_version = 3
 
-# Calculate standardization for 'mean' column
-localdf['mean_std'] = localdf['mean'].apply(lambda x: (x - localdf['mean'].mean()) / localdf['mean'].std(ddof=0))
+# csv files behind each dataset
+events_csv = "assets/peakdatemodified_wl_local_event_stats.csv"
+stations_csv = "assets/station_data.csv"
+music_csv = "assets/mxmh_survey_results.csv"
+whd_csv = "assets/WHD.csv"
 
-# Create a dictionary to map each location to its rank
-location_rank = {location: rank + 1 for rank, location in enumerate(locations)}
 
-# Apply the rank to the 'station_name' column
-localdf['rank'] = localdf['station_name'].map(lambda x: location_rank.get(x, None))
+# Data preprocessing
+# typed dates, year/month/day, season, days, domain, z-scores and rank are all computed in features.py
+def load_events():
+    localdf = pd.read_csv(events_csv)
+    return add_event_features(localdf, label_to_group, location_rank)
 
-# Sort the DataFrame by the 'rank' column
-localdf = localdf.sort_values("rank")
 
-# Create a trace for each station
-traces = []
-for station in locations:
-    trace = go.Bar(
-        x=season_counts.columns,
-        y=season_counts.loc[station],
-        name=station,
-        marker_color=location_colors[station]
-    )
-    traces.append(trace)
-
-# Create layout
-layout = go.Layout(
-    title='Number of Extreme Events for Each Season by Station, 1970-2022',
-    xaxis=dict(title='Season'),
-    yaxis=dict(title='Number of Observations'),
-    barmode='group'  # Use 'group' for grouped bar plot
-)
+# import all data for figures below
+# this is from the starting dataset
+# each table is parsed once and then memory-mapped from .cache/columnar, see columnar.py
+datasets.register("events", lambda: cached_table("events", [events_csv], load_events, version=preprocess_version),
+                  sources=[events_csv])
+datasets.register("stations", lambda: cached_table("stations", [stations_csv], lambda: pd.read_csv(stations_csv),
+                                                   version=preprocess_version),
+                  sources=[stations_csv])
+# events sorted by start date per station, for time window queries, see timeindex.py
+datasets.register("event_index", lambda: EventTimeIndex(datasets.get("events")), sources=[events_csv])
+# bitmaps behind the St. Lawrence filters, see filters.py
+datasets.register("event_filters", lambda: EventFilterIndex(datasets.get("events"), datasets.get("event_index")),
+                  sources=[events_csv])
+# counts and sums per station x season x year x domain, the bar chart and treemap boxes come from it, see cube.py
+datasets.register("event_cube", lambda: EventCube(datasets.get("events"), locations, season_order),
+                  sources=[events_csv])
+
+
+# the event table, or only the events matching the filters picked above the graphs
+def filtered_events(filters=None):
+    localdf = datasets.get("events")
+    mask = datasets.get("event_filters").mask(filters)
+    return localdf if mask is None else localdf[mask]
+
+
+# St. Lawrence figures, one function per graph so each graph can be built on its own
+# filters (from normalize_filters) limits them to some of the events, see filtered_events
+def can_histo(filters=None):
+    # Count the number of observations by 'station_name' and 'season'
+    # straight from the cube, unless the dates cut through a year
+    if EventCube.supports(filters):
+        counts, (stations, seasons) = datasets.get("event_cube").counts(['station_name', 'season'], filters)
+        # only the stations and seasons with events, same as the groupby below
+        season_counts = pd.DataFrame(counts, index=stations, columns=seasons).loc[counts.any(axis=1),
+                                                                                  counts.any(axis=0)]
+    else:
+        season_counts = filtered_events(filters).groupby(['station_name', 'season']).size().unstack(fill_value=0)
+    if season_counts.empty:
+        return placeholder_figure(no_events)
+    # seasons in alphabetical order, the cube keeps them in season_order
+    season_counts = season_counts.sort_index(axis=1)
 
-# Create figurea
-fig1 = go.Figure(data=traces, layout=layout)
-
-fig5 = px.density_heatmap(localdf, x="stn_lab", y="max", nbinsx=40, nbinsy=40, color_continuous_scale='aggrnyl',
-                          category_orders={'stn_lab': labs})
-fig5.update_layout(title="Saturation of Peakness by Station, 1970-2022", xaxis_title="Station Label",
-                   yaxis_title="Peak Water Level")
-
-fig3 = px.treemap(localdf, path=['domain', 'station_name', 'ind_in_stn'],
-                  color='max', color_continuous_scale='aggrnyl', hover_data=['date_max', 'days', 'mean'],
-                  color_continuous_midpoint=np.average(localdf['max'], weights=localdf['days']))
-fig3.update_layout(title="Max Events per Station by Peakness, 1970-2022")
-
-fig2 = px.scatter_ternary(localdf, a="max_std", b="mean_std", c="days_std", color="station_name",
-                          size="peak_ind", size_max=10,
-                          color_discrete_sequence=monochromatics)
-fig2.update_layout(title="Clustering of Extreme Events, 1970-2022")
-fig4 = go.Figure()
-# Create a trace for each station
-traces = []
-for station in locations:
-    tempdf = lookup.loc[(lookup['station_name'] == station)]
-    temp1df = localdf.loc[(localdf['station_name'] == station)]
-    for x in range(temp1df.shape[0]):
-        if x == 0:
-            trace = fig4.add_trace(go.Scattergeo(
-                lon=tempdf['lon'],
-                lat=tempdf['lat'],
-                text=[temp1df['stn_lab'].iloc[x], temp1df['duration'].iloc[x],
-                      temp1df['max'].iloc[x], temp1df['mean'].iloc[x], temp1df['min'].iloc[x]],
-                marker=dict(
-                    size=temp1df['max'].iloc[x],
-                    color=location_colors[station],
-                    line_color='rgb(40,40,40)',
-                    line_width=0.5,
-                    sizemode='area'),
-                legendgroup='station_name',
-                name=station))
-        else:
-            trace = fig4.add_trace(go.Scattergeo(
-                lon=tempdf['lon'],
-                lat=tempdf['lat'],
-                text=[temp1df['stn_lab'].iloc[x], temp1df['duration'].iloc[x],
-                      temp1df['max'].iloc[x], temp1df['mean'].iloc[x], temp1df['min'].iloc[x]],
-                marker=dict(
-                    size=temp1df['max'].iloc[x],
-                    color=location_colors[station],
-                    line_color='rgb(40,40,40)',
-                    line_width=0.5,
-                    sizemode='area'),
-                legendgroup='station_name',
-                showlegend=False,
-                name=station))
+    # Create a trace for each station
+    traces = []
+    for station in locations:
+        if station not in season_counts.index:
+            continue
+        trace = go.Bar(
+            x=season_counts.columns,
+            y=season_counts.loc[station],
+            name=station,
+            marker_color=location_colors[station]
+        )
         traces.append(trace)
 
-fig4.update_layout(
-    title_text='Locations on the St. Lawrence',
-    showlegend=True,
-    geo=dict(
-        landcolor='rgb(217, 217, 217)',
-        projection_scale=30,
-        center=dict(lat=lookup['lat'].iloc[2], lon=lookup['lon'].iloc[2]),  # this will center on the point
+    # Create layout
+    layout = go.Layout(
+        title=f'Number of Extreme Events for Each Season by Station, {describe(filters)}',
+        xaxis=dict(title='Season'),
+        yaxis=dict(title='Number of Observations'),
+        barmode='group'  # Use 'group' for grouped bar plot
     )
-)
+
+    # Create figure
+    return go.Figure(data=traces, layout=layout)
+
+
+def can_dense(filters=None):
+    localdf = filtered_events(filters)
+    if localdf.empty:
+        return placeholder_figure(no_events)
+    # the color map keeps every station's color when some stations are filtered out
+    fig = px.scatter_ternary(localdf, a="max_std", b="mean_std", c="days_std", color="station_name",
+                             size="peak_ind", size_max=10,
+                             color_discrete_sequence=monochromatics, color_discrete_map=location_colors)
+    fig.update_layout(title=f"Clustering of Extreme Events, {describe(filters)}")
+    return fig
+
+
+def can_main(station=None, filters=None):
+    aggregates = treemap_aggregates(filters)
+    # the events themselves are only needed for a clicked station's leaves, or when the cube can't be used
+    localdf = filtered_events(filters) if station is not None or aggregates is None else None
+    if aggregates is None and localdf.empty:
+        return placeholder_figure(no_events)
+    # only domains and stations at first, a station's events are added when it is clicked (see drill_main)
+    return build_event_treemap(localdf, station=station, colorscale='aggrnyl', aggregates=aggregates,
+                               title=f"Max Events per Station by Peakness, {describe(filters)}")
+
+
+def treemap_aggregates(filters=None):
+    # the treemap's domain and station boxes from the cube, None lets build_event_treemap group the events itself
+    if not EventCube.supports(filters):
+        return None
+    cube = datasets.get("event_cube")
+    columns = {"count": "count", "max_mean": "max", "days_mean": "days", "mean_mean": "mean"}
+    needed = list(columns) + ["max*days_sum", "days_sum", "max_sum"]
+    domains = cube.rollup(["domain"], filters, columns=needed)
+    if domains.empty:
+        return None
+    stations = cube.rollup(["domain", "station_name"], filters, columns=list(columns))
+    # same color midpoint as build_event_treemap gets from the events
+    cmid = treemap_midpoint(float(domains["max*days_sum"].sum()), float(domains["days_sum"].sum()),
+                            float(domains["max_sum"].sum()), int(domains["count"].sum()))
+    return domains[list(columns)].rename(columns=columns), stations[list(columns)].rename(columns=columns), cmid
+
+
+def can_pie(filters=None):
+    # Map of every event, one trace per station
+    fig = build_station_map(filtered_events(filters), datasets.get("stations"), locations, location_colors)
+    if filters:
+        fig.update_layout(title_text=f'Locations on the St. Lawrence, {describe(filters)}')
+    return fig
+
+
+def can_scatter(filters=None):
+    localdf = filtered_events(filters)
+    if localdf.empty:
+        return placeholder_figure(no_events)
+    # binned on the server, see figures.py
+    fig = build_density_heatmap(localdf, x="stn_lab", y="max", nbinsx=40, nbinsy=40, color_continuous_scale='aggrnyl',
+                                category_orders={'stn_lab': labs})
+    fig.update_layout(title=f"Saturation of Peakness by Station, {describe(filters)}", xaxis_title="Station Label",
+                      yaxis_title="Peak Water Level")
+    return fig
+
+
+# stands in for a graph until its figure is built (FAST_START=1), or when the filters match no event
+def placeholder_figure(text="Loading..."):
+    fig = go.Figure(layout=template["layout"])
+    fig.update_layout(xaxis_visible=False, yaxis_visible=False, annotations=[
+        dict(text=text, showarrow=False, xref="paper", yref="paper", x=0.5, y=0.5, font_size=20)])
+    return fig
+
+
+no_events = "No events match these filters"
+
+
+# figures shown before any button is clicked
+# the St. Lawrence view is what everyone sees first, so its tables are loaded right away
+# in fast-start mode the page gets placeholders instead and the figures come from a background thread
+if fast_start:
+    fig1 = fig2 = fig3 = fig4 = fig5 = placeholder_figure()
+else:
+    fig1 = can_histo()
+    fig2 = can_dense()
+    fig3 = can_main()
+    fig4 = can_pie()
+    fig5 = can_scatter()
+timeline.mark("St. Lawrence tables and figures")
+
 
 # DEMO DATA
-musicdf = pd.read_csv("assets/mxmh_survey_results.csv")
+def load_music():
+    musicdf = pd.read_csv(music_csv)
+
+    # add all constants and code associated with data churning below
+    musicdf = musicdf.drop(columns=['Timestamp', 'Permissions'])
+    # you can decide how to handle missing data per column
+    # for example, with age you might want to impute a value based on the mean
+    musicdf["Age"] = musicdf["Age"].fillna(value=round(musicdf.Age.mean()))
+    # for something like music effects, you might want to assume no effect since it was not reported
+    musicdf["Music effects"] = musicdf["Music effects"].fillna(value="No effect")
+    musicdf["While working"] = musicdf["While working"].fillna(value="No")
+    musicdf["Instrumentalist"] = musicdf["Instrumentalist"].fillna(value="No")
+    musicdf["Composer"] = musicdf["Composer"].fillna(value="No")
+    musicdf["Primary streaming service"] = musicdf["Primary streaming service"].fillna(
+        value="I do not use a streaming service.")
+    # feel free to impute missing values however you wish for your data
+    # you can also make new values
+    musicdf["Mental health severity"] = musicdf["Anxiety"] + musicdf["Depression"] + musicdf["Insomnia"] + musicdf[
+        "OCD"]
+    return musicdf
+
+
+# helper to pick a single year out of the world happiness data
+def load_whd_year(year):
+    yeardf = pd.read_csv(whd_csv).set_index('Country').query(f"Year=={year}")
+    yeardf = yeardf.drop(columns=['Year'])
+    yeardf["Happiness Ratio"] = 1 / yeardf["Happiness Rank"]
+    return yeardf
+
+
+# the demo datasets are only loaded the first time someone clicks their button, see datasets.py
+datasets.register("mxmh", lambda: cached_table("mxmh", [music_csv], load_music, version=preprocess_version),
+                  sources=[music_csv])
 # this is from the datasets that'll be added later
-whddf = pd.read_csv("assets/WHD.csv")
-whd15df = whddf.set_index('Country').query("Year==2015")
-whd15df = whd15df.drop(columns=['Year'])
-whd15df["Happiness Ratio"] = 1 / whd15df["Happiness Rank"]
-whd19df = whddf.set_index('Country').query("Year==2019")
-whd19df = whd19df.drop(columns=['Year'])
-whd19df["Happiness Ratio"] = 1 / whd19df["Happiness Rank"]
-
-# add all constants and code associated with data churning below
-musicdf = musicdf.drop(columns=['Timestamp', 'Permissions'])
-# you can decide how to handle missing data per column
-# for example, with age you might want to impute a value based on the mean
-musicdf["Age"] = musicdf["Age"].fillna(value=round(musicdf.Age.mean()))
-# for something like music effects, you might want to assume no effect since it was not reported
-musicdf["Music effects"] = musicdf["Music effects"].fillna(value="No effect")
-musicdf["While working"] = musicdf["While working"].fillna(value="No")
-musicdf["Instrumentalist"] = musicdf["Instrumentalist"].fillna(value="No")
-musicdf["Composer"] = musicdf["Composer"].fillna(value="No")
-musicdf["Primary streaming service"] = musicdf["Primary streaming service"].fillna(
-    value="I do not use a streaming service.")
-# feel free to impute missing values however you wish for your data
-# you can also make new values
-musicdf["Mental health severity"] = musicdf["Anxiety"] + musicdf["Depression"] + musicdf["Insomnia"] + musicdf["OCD"]
+datasets.register("whd", lambda: cached_table("whd", [whd_csv], lambda: pd.read_csv(whd_csv),
+                                              version=preprocess_version),
+                  sources=[whd_csv])
+datasets.register("whd19", lambda: cached_table("whd19", [whd_csv], lambda: load_whd_year(2019),
+                                                version=preprocess_version),
+                  sources=[whd_csv])
+
 # data churning is done!!!
 #
 # # time to create figures
@@ -419,6 +547,28 @@ app.layout = html.Div(
                         )
                     ],
                 ),
+                html.Div(
+                    children=[  # year picker for the multi-year data, only shown in YEAR_SLIDER mode
+                        dcc.Slider(id="whd-year", min=0, max=1, step=1, value=None, marks={}),
+                    ],
+                    id="year-div",
+                    style={"display": "none"},
+                ),
+                html.Div(
+                    children=[  # St. Lawrence filters, only shown while that dataset is picked
+                        dcc.Dropdown(id="filter-station", options=locations, value=[], multi=True,
+                                     placeholder="All stations"),
+                        dcc.Checklist(id="filter-domain", options=[{"label": f"Domain {domain}", "value": domain}
+                                                                   for domain in sorted(set(label_to_group.values()))],
+                                      value=[], inline=True),
+                        dcc.Checklist(id="filter-season", options=season_order, value=[], inline=True),
+                        dcc.DatePickerRange(id="filter-dates", clearable=True, start_date_placeholder_text="From",
+                                            end_date_placeholder_text="To"),
+                    ],
+                    id="filter-div",
+                    # switching datasets in the browser (PREFETCH_FIGURES) only knows the unfiltered figures
+                    style={"display": "none" if prefetch_figures else "block"},
+                ),
             ],
             style={
                 "width": "98%",
@@ -458,6 +608,8 @@ app.layout = html.Div(
                         """
             For the Canada dataset, interact with a comprehensive plot that shows the distribution of peak water level across all stations. Click to see extreme event details. 
 
+            Clicking a station or a domain here (or on any other St. Lawrence graph, where you can also box or lasso select) shows only those stations on the other graphs. Click it again, or double click the selection, to bring the other stations back.
+
             You can edit this panel to contain information that is relevant to the plots that populate in this area. 
             """
                     ),
@@ -644,8 +796,24 @@ app.layout = html.Div(
             },
             className="twelve columns pretty_container",
         ),
+        # settings for PREFETCH_FIGURES mode, read by assets/figure_bundle.js
+        dcc.Store(id="figure-bundle", data={
+            "enabled": prefetch_figures,
+            "url": app.get_relative_path("/_figure-bundle/"),
+            "datasets": ["can"] + [dataset for dataset in dataset_ids if dataset != "can"],
+            "graphs": graph_ids,
+        }),
+        dcc.Store(id="figure-bundle-status"),
+        # random id of this page load, lets the server drop requests for clicks that were superseded
+        # kept in memory so a reload gets a new one: the buttons' click counts start from 0 again then
+        dcc.Store(id="client-id", storage_type="memory"),
+        # stations picked on one St. Lawrence figure to narrow the others down to, see cross_filter
+        dcc.Store(id="cross-selection"),
+        # in fast-start mode, checks whether the real St. Lawrence figures are ready to replace the placeholders
+        dcc.Interval(id="startup-poll", interval=300, disabled=not fast_start),
     ],
 )
+timeline.mark("layout")
 
 # callbacks
 # this is what makes the app interactive
@@ -653,191 +821,478 @@ app.layout = html.Div(
 # first function create show/hide callbacks for each info modal
 # if you change any of the IDs above, you need to change them here
 # change at your own risk
+# these run in the browser (clientside), so opening or closing a modal never sends a request to the server
+toggle_modal = """
+function(n_show, n_close) {
+    const triggered = dash_clientside.callback_context.triggered;
+    if (triggered.length && triggered[0].prop_id.startsWith("show-")) {
+        return [{"display": "block"}, {"zIndex": 1003}];
+    }
+    return [{"display": "none"}, {"zIndex": 0}];
+}
+"""
 for id in ["histo", "dense", "main", "pie", "scatter"]:
-
-    @app.callback(
+    app.clientside_callback(
+        toggle_modal,
         [Output(f"{id}-modal", "style"), Output(f"{id}-div", "style")],
         [Input(f"show-{id}-modal", "n_clicks"), Input(f"close-{id}-modal", "n_clicks")],
     )
-    def toggle_modal(n_show, n_close):
-        ctx = dash.callback_context
-        if ctx.triggered and ctx.triggered[0]["prop_id"].startswith("show-"):
-            return {"display": "block"}, {"zIndex": 1003}
-        else:
-            return {"display": "none"}, {"zIndex": 0}
-
-
-# create callback to show each graph. you can't do multiple callbacks that use the same output/input ID
-# so that's why we do it in a big function like this
-# if you need help understanding each of the graph plots I comment about them up at their initialization
-@app.callback([
-    Output("histo-graph", "figure"),
-    Output("dense-graph", "figure"),
-    Output("main-graph", "figure"),
-    Output("pie-graph", "figure"),
-    Output("scatter-graph", "figure")],
-    [Input("mxmh", "n_clicks"),
-     Input("can", "n_clicks"),
-     Input("whd19", "n_clicks"),
-     Input("whd", "n_clicks")], prevent_initial_call=True)
-# you need the number of input in update_graphs to match the number of buttons you have updating graphs
-def update_graphs(b1, b2, b3, b4):
+
+
+# give the page an id when it loads, a reload starts over with a new one
+app.clientside_callback(
+    """
+    function(bundle, client_id) {
+        return client_id || (Date.now().toString(36) + Math.random().toString(36).slice(2));
+    }
+    """,
+    Output("client-id", "data"),
+    Input("figure-bundle", "data"),
+    State("client-id", "data"),
+)
+
+# newest button click of every tab. when somebody clicks through the datasets quickly, requests still
+# queued for the datasets they skipped past give up instead of building figures nobody will see
+click_tracker = ClickTracker()
+
+
+# builds the years next to the one being looked at, so moving the slider one step is already cached
+# pools don't survive a fork (gunicorn forks its workers from the master), so each process makes its own
+def start_pools():
+    global frame_prefetch_pool
+    frame_prefetch_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="frames")
+
+
+start_pools()
+os.register_at_fork(after_in_child=start_pools)
+
+
+# the St. Lawrence filter controls, in the order update_graph and drill_main get their values
+filter_inputs = [("filter-station", "value"), ("filter-domain", "value"), ("filter-season", "value"),
+                 ("filter-dates", "start_date"), ("filter-dates", "end_date")]
+filter_ids = {component for component, _ in filter_inputs}
+
+
+# which button was clicked last
+def triggered_dataset():
     triggered_id = ctx.triggered[0]['prop_id']
-    if 'mxmh.n_clicks' == triggered_id:
-        return update_mxmh()
+    if triggered_id.split('.')[0] in filter_ids:
+        # the filters are only shown with the St. Lawrence data
+        return 'can'
+    elif 'mxmh.n_clicks' == triggered_id:
+        return 'mxmh'
     elif 'can.n_clicks' == triggered_id:
-        return update_can()
+        return 'can'
     elif 'whd19.n_clicks' == triggered_id:
-        return update_whd19()
+        return 'whd19'
     else:
-        return update_whd()
+        return 'whd'
+
+
+# builder of one graph wrapped in the sampling profiler, which only does something when PROFILE_DIR is set
+# (see profiling.py). builds outside of a callback (warmup, the fast-start background thread) get a profile this way
+def profiled_builder(dataset, graph, build=None, **labels):
+    build = build or figure_builders[dataset][graph]
+
+    def run():
+        with profiled("build", dataset=dataset, graph=graph, **labels):
+            return build()
+    return run
+
+
+# build (or fetch from the cache) one graph of one dataset, as a cache entry (figure dict and its JSON)
+# cancelled is an optional check from click_tracker, raises Superseded when it returns True
+# filters (St. Lawrence only) is the result of normalize_filters, each combination is cached on its own
+def render_entry(dataset, graph, cancelled=None, filters=None):
+    # the figures never change unless the csv does, so only the first click builds them
+    # concurrent requests for the same figure share one build, see coalesce.py
+    if filters:
+        build = profiled_builder(dataset, graph, partial(figure_builders[dataset][graph], filters=filters))
+        return filtered_cache.get_entry((dataset, graph, filter_key(filters)), build, dataset_sources[dataset],
+                                        cancelled)
+    return figure_cache.get_entry((dataset, graph), profiled_builder(dataset, graph), dataset_sources[dataset],
+                                  cancelled)
+
+
+def render_figure(dataset, graph, cancelled=None, filters=None):
+    return render_entry(dataset, graph, cancelled, filters).figure
+
+
+# one year of one of the animated whd graphs, each year is cached on its own (returns the cache entry)
+def render_frame(graph, year, cancelled=None):
+    years = whd_years()
+    if year not in years:
+        year = years[-1]
+    sources = dataset_sources['whd']
+    for neighbour in (year - 1, year + 1):
+        if neighbour in years:
+            frame_prefetch_pool.submit(figure_cache.get, ('whd', graph, neighbour),
+                                       partial(figure_builders['whd'][graph], neighbour), sources)
+    build = profiled_builder('whd', graph, partial(figure_builders['whd'][graph], year), year=year)
+    return figure_cache.get_entry(('whd', graph, year), build, sources, cancelled)
+
+
+# clicking a station on the St. Lawrence treemap loads that station's events into it
+# the other datasets' main graphs aren't treemaps with station ids, so their clicks are ignored
+@app.callback(
+    Output("main-graph", "figure", allow_duplicate=True),
+    Input("main-graph", "clickData"),
+    [State(component, prop) for component, prop in filter_inputs], prevent_initial_call=True)
+def drill_main(click_data, *filter_values):
+    point = (click_data or {}).get("points", [{}])[0]
+    node_id = str(point.get("id", ""))
+    station = node_id.split("/")[1] if node_id.count("/") == 1 else None
+    if station not in locations:
+        raise PreventUpdate
+    filters = normalize_filters(*filter_values)
+    with callback_metrics.compute("drill_main", dataset="can", graph="main"), \
+            profiled("drill_main", dataset="can", graph="main", station=station):
+        cache = filtered_cache if filters else figure_cache
+        entry = cache.get_entry(('can', 'main', station, filter_key(filters)), lambda: can_main(station, filters),
+                                dataset_sources['can'])
+    return response_compressor.cached_json(entry)
+
+
+# linked selection: clicking (or box / lasso selecting) stations on one St. Lawrence figure shows only
+# those stations on the other four, sent as patches of the cached figures (see crossfilter.py)
+# the heatmap and the treemap only take clicks, the other three can also be box / lasso selected
+selectable_graphs = ["histo", "dense", "pie"]
+station_slices = SliceCache(dict(zip(labs, locations)))
+domain_stations = {}
+for lab, location in zip(labs, locations):
+    domain_stations.setdefault(label_to_group[lab], []).append(location)
+# the parts of the treemap that depend on the stations shown
+treemap_paths = [("data", 0, field) for field in ("ids", "labels", "parents", "values", "customdata", "level")] + [
+    ("data", 0, "marker", "colors"), ("layout", "coloraxis", "cmid"), ("layout", "title", "text")]
+
+
+def selected_stations(graph, points, filters):
+    # stations behind the clicked / selected points of one graph, None if there are none
+    if graph == 'main':
+        return treemap_stations(points, domain_stations)
+    figure = render_figure('can', graph, filters=filters)
+    return station_slices.get(('can', graph, filter_key(filters)), figure).stations_of(points)
+
+
+def station_patch(graph, stations, filters):
+    """
+    Patch of one St. Lawrence graph showing only stations, or every station matching filters when stations is None
+    """
+    if graph == 'main':
+        if stations is None:
+            figure = render_figure('can', 'main', filters=filters)
+        else:
+            # the station boxes of the selection, rolled up again (from the cube when the dates allow it)
+            picked = dict(filters or {}, stations=sorted(stations, key=str))
+            figure = can_main(None, picked).to_plotly_json()
+        return copy_patch(figure, treemap_paths)
+    figure = render_figure('can', graph, filters=filters)
+    return station_slices.get(('can', graph, filter_key(filters)), figure).patch(stations)
 
 
-# the output should be returning the figures you wanted to update
-def update_mxmh():
-    fig3 = go.Figure()
-    fig3.add_trace(go.Violin(x=musicdf['Music effects'][musicdf['Music effects'] != 'No effect'],
-                             y=musicdf['Depression'][musicdf['Music effects'] != 'No effect'],
-                             legendgroup='Depression/10', scalegroup='Depression/10', name='Depression/10',
-                             line_color='hotpink', box_visible=True)
-                   )
-    fig3.add_trace(go.Violin(x=musicdf['Music effects'][musicdf['Music effects'] != 'No effect'],
-                             y=musicdf['Anxiety'][musicdf['Music effects'] != 'No effect'],
-                             legendgroup='Anxiety/10', scalegroup='Anxiety/10', name='Anxiety/10',
-                             line_color='green', box_visible=True)
-                   )
-    fig3.add_trace(go.Violin(x=musicdf['Music effects'][musicdf['Music effects'] != 'No effect'],
-                             y=musicdf['OCD'][musicdf['Music effects'] != 'No effect'],
-                             legendgroup='OCD/10', scalegroup='OCD/10', name='OCD/10',
-                             line_color='blue', box_visible=True)
-                   )
-    fig3.add_trace(go.Violin(x=musicdf['Music effects'][musicdf['Music effects'] != 'No effect'],
-                             y=musicdf['Insomnia'][musicdf['Music effects'] != 'No effect'],
-                             legendgroup='Insomnia/10', scalegroup='Insomnia/10', name='Insomnia/10',
-                             line_color='purple', box_visible=True)
-                   )
-    fig3.update_traces(meanline_visible=True)
-    fig3.update_layout(violingap=0, violinmode='group')
-    fig3.update_layout(yaxis_title="Self-Ranked Score Out of 10",
-                       xaxis_title="Music Tends to ______ My Mental Health")
-
-    fig1 = px.histogram(musicdf, x="Fav genre", histfunc='count', color="Music effects",
-                        color_discrete_sequence=px.colors.qualitative.Prism)
-    fig1.update_layout(yaxis_title="Number of People")
-
-    fig2 = px.density_heatmap(musicdf, x="Depression", y="Anxiety", nbinsx=10, nbinsy=10, facet_row="Composer",
-                              facet_col="Instrumentalist")
-
-    fig5 = px.scatter_ternary(musicdf, a="OCD", b="Anxiety", c="Insomnia", color="Exploratory",
-                              size="Mental health severity", size_max=20,
-                              color_discrete_sequence=px.colors.qualitative.Prism)
-
-    fig4 = px.sunburst(musicdf, path=['Primary streaming service', 'Exploratory'], values='Hours per day',
-                       color='Primary streaming service', color_discrete_sequence=px.colors.sequential.Plasma)
-    return fig1, fig2, fig3, fig4, fig5
+def cross_filter_patches(origin, stations, filters, filtered=(), redrawn=False):
+    """
+    What cross_filter sends to each graph, in graph_ids order
+    filtered are the graphs currently narrowed down by an earlier selection, stations None clears the selection
+    redrawn means origin is redrawn by another callback (drill_main, when a treemap station is clicked)
+    """
+    patches = []
+    for graph in graph_ids:
+        if stations is not None and graph != origin:
+            patches.append(station_patch(graph, stations, filters))
+        elif graph in filtered and not (graph == origin and redrawn):
+            # the graph picked on shows all its stations again, so another one can be picked
+            patches.append(station_patch(graph, None, filters))
+        else:
+            patches.append(no_update)
+    return patches
+
+
+event_inputs = [(graph, "clickData") for graph in graph_ids] + [(graph, "selectedData") for graph in selectable_graphs]
+
+
+@app.callback(
+    [Output(f"{graph}-graph", "figure", allow_duplicate=True) for graph in graph_ids]
+    + [Output("cross-selection", "data")],
+    [Input(f"{graph}-graph", prop) for graph, prop in event_inputs],
+    [State(component, prop) for component, prop in filter_inputs]
+    + [State(dataset, "n_clicks") for dataset in dataset_ids]
+    + [State("filter-div", "style"), State("cross-selection", "data")],
+    prevent_initial_call=True)
+def cross_filter(*values):
+    filter_values = values[len(event_inputs):len(event_inputs) + len(filter_inputs)]
+    clicks = values[len(event_inputs) + len(filter_inputs):-2]
+    filter_style, previous = values[-2:]
+    # the filters are only shown with the St. Lawrence data (and never in PREFETCH_FIGURES mode,
+    # where the figures are switched in the browser), the other datasets' graphs have no stations
+    if (filter_style or {}).get("display") != "block":
+        raise PreventUpdate
+    origin = ctx.triggered_id.split("-")[0]
+    points = (ctx.triggered[0]["value"] or {}).get("points") or []
+    filters = normalize_filters(*filter_values)
+
+    # a selection made before the filters or the dataset changed is gone from the graphs already
+    context = {"filters": filters, "clicks": sum(count or 0 for count in clicks)}
+    if not previous or previous["context"] != context:
+        previous = None
+
+    with callback_metrics.compute("cross_filter", dataset="can", graph=origin), \
+            profiled("cross_filter", dataset="can", graph=origin):
+        stations = selected_stations(origin, points, filters)
+        if stations is not None:
+            stations = sorted(stations, key=locations.index)
+        if stations is None:
+            # a double click or an empty box clears the selection, but only on the graph it was made on
+            if previous is None or previous["origin"] != origin:
+                raise PreventUpdate
+        elif previous is not None and previous["origin"] == origin and previous["stations"] == stations \
+                and ctx.triggered[0]["prop_id"].endswith("clickData"):
+            # clicking the same station again clears it too
+            stations = None
+
+        filtered = [graph for graph in graph_ids if graph != previous["origin"]] if previous else []
+        redrawn = origin == 'main' and bool(points) and str(points[0].get("id", "")).count("/") == 1
+        patches = cross_filter_patches(origin, stations, filters, filtered, redrawn)
+    selection = None if stations is None else {"origin": origin, "stations": stations, "context": context}
+    return patches + [selection]
+
+
+# every figure of a dataset in one JSON object, compressed once and kept until the csv changes
+# this is what the browser downloads in PREFETCH_FIGURES mode
+figure_bundles = {}
+
+
+@server.route("/_figure-bundle/<dataset>.json")
+def figure_bundle(dataset):
+    if dataset not in figure_builders:
+        abort(404)
+    sources = dataset_sources[dataset]
+    signature = file_signature(sources)
+    bundle = figure_bundles.get(dataset)
+    if bundle is None or bundle["signature"] != signature:
+        # the cached figures are already JSON, so they are pasted together instead of encoded again
+        body = b"{" + b",".join(json.dumps(graph).encode() + b":" + figure_cache.get_json(
+            (dataset, graph), figure_builders[dataset][graph], sources) for graph in graph_ids) + b"}"
+        bundle = {
+            "signature": signature,
+            "etag": content_etag(body),
+            "body": body,
+        }
+        figure_bundles[dataset] = bundle
+
+    encoding = pick_encoding(request.accept_encodings)
+    if bundle["etag"] in request.if_none_match:
+        response = Response(status=304)
+    elif encoding is not None:
+        if encoding not in bundle:
+            bundle[encoding] = compress(bundle["body"], encoding)
+        response = Response(bundle[encoding], mimetype="application/json")
+        response.headers["Content-Encoding"] = encoding
+    else:
+        response = Response(bundle["body"], mimetype="application/json")
+    response.set_etag(bundle["etag"])
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+if prefetch_figures:
+    # switch datasets in the browser from the downloaded bundles
+    app.clientside_callback(
+        ClientsideFunction(namespace="figure_bundle", function_name="switch_dataset"),
+        [Output(f"{graph}-graph", "figure") for graph in graph_ids],
+        [Input(dataset, "n_clicks") for dataset in dataset_ids],
+        State("figure-bundle", "data"),
+        prevent_initial_call=True,
+    )
 
+    # download every bundle once the first page has been drawn
+    app.clientside_callback(
+        ClientsideFunction(namespace="figure_bundle", function_name="prefetch"),
+        Output("figure-bundle-status", "data"),
+        Input("figure-bundle", "data"),
+    )
+else:
+    # create one callback per graph. each graph sends its own request and updates as soon as its figure is ready,
+    # so a slow figure (like the animated map of the whd dataset) doesn't hold back the other four
+    # if you add a button, add it to dataset_ids and a branch in triggered_dataset
+    # the year slider only exists for the whd dataset, moving it only redraws the animated graphs
+    for graph in graph_ids:
+
+        @app.callback(
+            Output(f"{graph}-graph", "figure"),
+            [Input(dataset, "n_clicks") for dataset in dataset_ids] + [Input("whd-year", "value")]
+            + [Input(component, prop) for component, prop in filter_inputs],
+            State("client-id", "data"),
+            prevent_initial_call=True)
+        # you need the number of input in update_graph to match the number of buttons you have updating graphs
+        # changing a St. Lawrence filter redraws all five graphs from the matching events
+        def update_graph(b1, b2, b3, b4, year, stations, domains, seasons, start, end, client_id, graph=graph):
+            dataset = triggered_dataset()
+            filters = normalize_filters(stations, domains, seasons, start, end) if dataset == 'can' else None
+            # the total number of clicks only goes up, so a request with fewer clicks than the newest is stale
+            cancelled = click_tracker.checker(client_id, sum(clicks or 0 for clicks in (b1, b2, b3, b4)))
+            if ctx.triggered_id == "whd-year" and not (dataset == 'whd' and year_slider and graph in animated_graphs):
+                raise PreventUpdate
+            try:
+                with callback_metrics.compute("update_graph", dataset=dataset, graph=graph), \
+                        profiled("update_graph", dataset=dataset, graph=graph):
+                    if dataset == 'whd' and year_slider and graph in animated_graphs:
+                        entry = render_frame(graph, year, cancelled)
+                    else:
+                        entry = render_entry(dataset, graph, cancelled, filters)
+                # the JSON comes from the cache, dash doesn't encode the figure again
+                return response_compressor.cached_json(entry)
+            except Superseded:
+                raise PreventUpdate
+
+    # show the filters with the St. Lawrence data only
+    @app.callback(
+        Output("filter-div", "style"),
+        [Input(dataset, "n_clicks") for dataset in dataset_ids], prevent_initial_call=True)
+    def update_filter_div(b1, b2, b3, b4):
+        return {"display": "block" if triggered_dataset() == 'can' else "none"}
 
-def update_can():
-    # Create a trace for each station
-    traces = []
-    for station in locations:
-        trace = go.Bar(
-            x=season_counts.columns,
-            y=season_counts.loc[station],
-            name=station,
-            marker_color=location_colors[station]
-        )
-        traces.append(trace)
+    # show the slider when the whd dataset is picked, hide it for the others
+    @app.callback(
+        [Output("year-div", "style"),
+         Output("whd-year", "min"),
+         Output("whd-year", "max"),
+         Output("whd-year", "marks"),
+         Output("whd-year", "value")],
+        [Input(dataset, "n_clicks") for dataset in dataset_ids],
+        State("whd-year", "value"), prevent_initial_call=True)
+    def update_year_slider(b1, b2, b3, b4, year):
+        if not year_slider or triggered_dataset() != 'whd':
+            return {"display": "none"}, no_update, no_update, no_update, no_update
+        years = whd_years()
+        # keep the year the user already picked, otherwise start on the latest one
+        value = no_update if year in years else years[-1]
+        return {"display": "block"}, years[0], years[-1], {year: str(year) for year in years}, value
+
+
+# swap the placeholders for the St. Lawrence figures once the background thread has built them
+# (unless a dataset button was clicked in the meantime, then its callbacks take care of the graphs)
+if fast_start:
+    @app.callback(
+        [Output(f"{graph}-graph", "figure", allow_duplicate=True) for graph in graph_ids]
+        + [Output("startup-poll", "disabled")],
+        Input("startup-poll", "n_intervals"),
+        [State(dataset, "n_clicks") for dataset in dataset_ids],
+        prevent_initial_call=True)
+    def fill_initial_figures(n_intervals, *clicks):
+        if any(clicks):
+            return [no_update] * len(graph_ids) + [True]
+        if not initial_figures_ready.is_set():
+            raise PreventUpdate
+        return [response_compressor.cached_json(render_entry('can', graph)) for graph in graph_ids] + [True]
 
-    # Create layout
-    layout = go.Layout(
-        title='Number of Extreme Events for Each Season by Station, 1970-2022',
-        xaxis=dict(title='Season'),
-        yaxis=dict(title='Number of Observations'),
-        barmode='group'  # Use 'group' for grouped bar plot
-    )
+timeline.mark("callbacks")
 
-    # Create figurea
-    fig1 = go.Figure(data=traces, layout=layout)
 
-    fig5 = px.density_heatmap(localdf, x="stn_lab", y="max", nbinsx=40, nbinsy=40, color_continuous_scale='aggrnyl',
-                              category_orders={'stn_lab': labs})
-    fig5.update_layout(title="Saturation of Peakness by Station, 1970-2022", xaxis_title="Station Label",
-                       yaxis_title="Peak Water Level")
+# the output should be returning the figures you wanted to update
+def mxmh_histo():
+    musicdf = datasets.get("mxmh")
+    # aggregated on the server, see figures.py
+    fig = build_aggregated_histogram(musicdf, x="Fav genre", histfunc='count', color="Music effects",
+                                     color_discrete_sequence=px.colors.qualitative.Prism)
+    fig.update_layout(yaxis_title="Number of People")
+    return fig
+
+
+def mxmh_dense():
+    musicdf = datasets.get("mxmh")
+    # binned on the server, see figures.py
+    return build_density_heatmap(musicdf, x="Depression", y="Anxiety", nbinsx=10, nbinsy=10, facet_row="Composer",
+                                 facet_col="Instrumentalist")
+
+
+def mxmh_main():
+    musicdf = datasets.get("mxmh")
+    fig = go.Figure()
+    fig.add_trace(go.Violin(x=musicdf['Music effects'][musicdf['Music effects'] != 'No effect'],
+                            y=musicdf['Depression'][musicdf['Music effects'] != 'No effect'],
+                            legendgroup='Depression/10', scalegroup='Depression/10', name='Depression/10',
+                            line_color='hotpink', box_visible=True)
+                  )
+    fig.add_trace(go.Violin(x=musicdf['Music effects'][musicdf['Music effects'] != 'No effect'],
+                            y=musicdf['Anxiety'][musicdf['Music effects'] != 'No effect'],
+                            legendgroup='Anxiety/10', scalegroup='Anxiety/10', name='Anxiety/10',
+                            line_color='green', box_visible=True)
+                  )
+    fig.add_trace(go.Violin(x=musicdf['Music effects'][musicdf['Music effects'] != 'No effect'],
+                            y=musicdf['OCD'][musicdf['Music effects'] != 'No effect'],
+                            legendgroup='OCD/10', scalegroup='OCD/10', name='OCD/10',
+                            line_color='blue', box_visible=True)
+                  )
+    fig.add_trace(go.Violin(x=musicdf['Music effects'][musicdf['Music effects'] != 'No effect'],
+                            y=musicdf['Insomnia'][musicdf['Music effects'] != 'No effect'],
+                            legendgroup='Insomnia/10', scalegroup='Insomnia/10', name='Insomnia/10',
+                            line_color='purple', box_visible=True)
+                  )
+    fig.update_traces(meanline_visible=True)
+    fig.update_layout(violingap=0, violinmode='group')
+    fig.update_layout(yaxis_title="Self-Ranked Score Out of 10",
+                      xaxis_title="Music Tends to ______ My Mental Health")
+    return fig
+
+
+def mxmh_pie():
+    musicdf = datasets.get("mxmh")
+    return px.sunburst(musicdf, path=['Primary streaming service', 'Exploratory'], values='Hours per day',
+                       color='Primary streaming service', color_discrete_sequence=px.colors.sequential.Plasma)
 
-    fig3 = px.treemap(localdf, path=['domain', 'station_name', 'ind_in_stn'],
-                      color='max', color_continuous_scale='aggrnyl', hover_data=['date_max', 'days', 'mean'],
-                      color_continuous_midpoint=np.average(localdf['max'], weights=localdf['days']))
-    fig3.update_layout(title="Max Events per Station by Peakness, 1970-2022")
 
-    fig2 = px.scatter_ternary(localdf, a="max_std", b="mean_std", c="days_std", color="station_name",
-                              size="peak_ind", size_max=10,
-                              color_discrete_sequence=monochromatics)
-    fig2.update_layout(title="Clustering of Extreme Events, 1970-2022")
-    # Create a trace for each station
-    traces = []
-    for station in locations:
-        tempdf = df.loc[(df['station_name'] == station)]
-        temp1df = localdf.loc[(localdf['station_name'] == station)]
-        for x in range(temp1df.shape[0]):
-            if x == 0:
-                trace = fig4.add_trace(go.Scattergeo(
-                    lon=tempdf['lon'],
-                    lat=tempdf['lat'],
-                    text=[temp1df['stn_lab'].iloc[x], temp1df['duration'].iloc[x],
-                          temp1df['max'].iloc[x], temp1df['mean'].iloc[x], temp1df['min'].iloc[x]],
-                    marker=dict(
-                        size=temp1df['max'].iloc[x],
-                        color=location_colors[station],
-                        line_color='rgb(40,40,40)',
-                        line_width=0.5,
-                        sizemode='area'),
-                    legendgroup='station_name',
-                    name=station))
-            else:
-                trace = fig4.add_trace(go.Scattergeo(
-                    lon=tempdf['lon'],
-                    lat=tempdf['lat'],
-                    text=[temp1df['stn_lab'].iloc[x], temp1df['duration'].iloc[x],
-                          temp1df['max'].iloc[x], temp1df['mean'].iloc[x], temp1df['min'].iloc[x]],
-                    marker=dict(
-                        size=temp1df['max'].iloc[x],
-                        color=location_colors[station],
-                        line_color='rgb(40,40,40)',
-                        line_width=0.5,
-                        sizemode='area'),
-                    legendgroup='station_name',
-                    showlegend=False,
-                    name=station))
-            traces.append(trace)
-
-    fig4.update_layout(
-        title_text='Locations on the St. Lawrence',
-        showlegend=True,
-        geo=dict(
-            landcolor='rgb(217, 217, 217)',
-            projection_scale=30,
-            center=dict(lat=df['lat'].iloc[2], lon=df['lon'].iloc[2]),  # this will center on the point
-        )
-    )
-    return fig1, fig2, fig3, fig4, fig5
+def mxmh_scatter():
+    musicdf = datasets.get("mxmh")
+    return px.scatter_ternary(musicdf, a="OCD", b="Anxiety", c="Insomnia", color="Exploratory",
+                              size="Mental health severity", size_max=20,
+                              color_discrete_sequence=px.colors.qualitative.Prism)
 
 
-def update_whd19():
-    fig3 = px.choropleth(whd19df, locations="iso_alpha",
-                         color="Happiness Score", fitbounds='locations',
-                         hover_name=whd19df.index, hover_data=['Economy (GDP per Capita)', 'Family',
-                                                               'Health (Life Expectancy)', 'Freedom',
-                                                               'Trust (Government Corruption)', 'Generosity'],
-                         color_continuous_scale=px.colors.sequential.RdBu)
-    fig3.update_layout(margin=dict(l=0, r=0, t=0, b=0),
-                       legend=dict(orientation='h', y=-0.1, yanchor='bottom', x=0.5, xanchor='center'))
+def whd19_histo():
+    whd19df = datasets.get("whd19")
+    # aggregated on the server, see figures.py
+    return build_aggregated_histogram(whd19df, x="Happiness Score", y='Health (Life Expectancy)', histfunc='avg',
+                                      color="Region", color_discrete_sequence=px.colors.sequential.Plasma)
+
+
+def whd19_dense():
+    whd19df = datasets.get("whd19")
+    fig = px.treemap(whd19df, path=[px.Constant("world"), 'Region', whd19df.index], values='Happiness Ratio',
+                     color='Happiness Score', hover_data=['Happiness Ratio'], color_continuous_scale='RdBu',
+                     color_continuous_midpoint=np.average(whd19df['Happiness Score'],
+                                                          weights=whd19df['Happiness Ratio'])
+                     )
+    fig.update_layout(margin=dict(t=50, l=25, r=25, b=25))
+    return fig
+
+
+def whd19_main():
+    whd19df = datasets.get("whd19")
+    fig = px.choropleth(whd19df, locations="iso_alpha",
+                        color="Happiness Score", fitbounds='locations',
+                        hover_name=whd19df.index, hover_data=['Economy (GDP per Capita)', 'Family',
+                                                              'Health (Life Expectancy)', 'Freedom',
+                                                              'Trust (Government Corruption)', 'Generosity'],
+                        color_continuous_scale=px.colors.sequential.RdBu)
+    fig.update_layout(margin=dict(l=0, r=0, t=0, b=0),
+                      legend=dict(orientation='h', y=-0.1, yanchor='bottom', x=0.5, xanchor='center'))
+    return fig
+
+
+def whd19_pie():
+    whd19df = datasets.get("whd19")
+    return px.sunburst(whd19df, path=['Region', whd19df.index], values='Happiness Ratio',
+                       color='Happiness Score', hover_data=['Happiness Ratio'], color_continuous_scale='RdBu',
+                       color_continuous_midpoint=np.average(whd19df['Happiness Score'],
+                                                            weights=whd19df['Happiness Ratio']))
 
-    fig1 = px.histogram(whd19df, x="Happiness Score", y='Health (Life Expectancy)', histfunc='avg',
-                        color="Region", color_discrete_sequence=px.colors.sequential.Plasma)
 
+def whd19_scatter():
+    whd19df = datasets.get("whd19")
     tempdf = whd19df.where(whd19df["Happiness Score"] > 5)
-    fig5 = px.scatter_3d(tempdf,
+    return px.scatter_3d(tempdf,
                          x="Economy (GDP per Capita)", y="Trust (Government Corruption)", z="Freedom",
                          color='Region', hover_name=whd19df.index, hover_data=['Economy (GDP per Capita)', 'Family',
                                                                                'Health (Life Expectancy)', 'Freedom',
@@ -845,57 +1300,164 @@ def update_whd19():
                                                                                'Generosity'],
                          color_discrete_sequence=px.colors.sequential.Plasma)
 
-    fig2 = px.treemap(whd19df, path=[px.Constant("world"), 'Region', whd19df.index], values='Happiness Ratio',
-                      color='Happiness Score', hover_data=['Happiness Ratio'], color_continuous_scale='RdBu',
-                      color_continuous_midpoint=np.average(whd19df['Happiness Score'],
-                                                           weights=whd19df['Happiness Ratio'])
-                      )
-    fig2.update_layout(margin=dict(t=50, l=25, r=25, b=25))
 
-    fig4 = px.sunburst(whd19df, path=['Region', whd19df.index], values='Happiness Ratio',
-                       color='Happiness Score', hover_data=['Happiness Ratio'], color_continuous_scale='RdBu',
-                       color_continuous_midpoint=np.average(whd19df['Happiness Score'],
-                                                            weights=whd19df['Happiness Ratio']))
-    return fig1, fig2, fig3, fig4, fig5
-
-
-def update_whd():
-    fig3 = px.choropleth(whddf, locations="iso_alpha",
-                         color="Happiness Score", fitbounds='locations',
-                         hover_name="Country", hover_data=['Economy (GDP per Capita)', 'Family',
-                                                           'Health (Life Expectancy)', 'Freedom',
-                                                           'Trust (Government Corruption)', 'Generosity'],
-                         color_continuous_scale=px.colors.sequential.RdBu, animation_frame="Year")
-    fig3.update_layout(margin=dict(l=0, r=0, t=0, b=0),
-                       legend=dict(orientation='h', y=-0.1, yanchor='bottom', x=0.5, xanchor='center'))
-
-    fig1 = px.histogram(whddf, x="Happiness Score", histfunc='count', color="Region",
-                        color_discrete_sequence=px.colors.sequential.Plasma,
-                        animation_frame="Year")
-    fig1.update_layout(yaxis_title="Number of Countries")
-
-    fig5 = px.scatter_ternary(whddf, a="Generosity", b="Trust (Government Corruption)", c="Freedom",
-                              hover_name="Country", color="Region", size="Happiness Score", size_max=15,
-                              hover_data=['Happiness Score', 'Economy (GDP per Capita)', 'Family',
-                                          'Health (Life Expectancy)', 'Freedom',
-                                          'Trust (Government Corruption)', 'Generosity'],
-                              animation_frame="Year", color_discrete_sequence=px.colors.sequential.Plasma)
-
-    fig2 = px.treemap(whddf, path=[px.Constant("world"), 'Region', 'Country'], values='Economy (GDP per Capita)',
-                      color='Happiness Score', hover_data=['Economy (GDP per Capita)'],
-                      color_continuous_scale='RdBu',
-                      color_continuous_midpoint=np.average(whddf['Happiness Score'],
-                                                           weights=whddf['Economy (GDP per Capita)']))
-    fig2.update_layout(margin=dict(t=50, l=25, r=25, b=25))
-
-    fig4 = px.sunburst(whddf, path=['Region', 'Country'], values='Trust (Government Corruption)',
+# the multi-year figures take an optional year. without one they animate over every year,
+# with one (YEAR_SLIDER mode) they only show that year, with the same colors and scales as the animation
+def whd_histo(year=None):
+    whddf = datasets.get("whd")
+    # aggregated on the server, one small set of bars per year, see figures.py
+    if year is None:
+        fig = build_aggregated_histogram(whddf, x="Happiness Score", histfunc='count', color="Region",
+                                         color_discrete_sequence=px.colors.sequential.Plasma,
+                                         animation_frame="Year")
+    else:
+        fig = build_aggregated_histogram(whd_year(year), x="Happiness Score", histfunc='count', color="Region",
+                                         color_discrete_sequence=px.colors.sequential.Plasma,
+                                         category_orders={'Region': whd_regions()},
+                                         bin_edges=nice_bin_edges(whddf["Happiness Score"]))
+        fig.update_layout(title=f"Year={year}")
+    fig.update_layout(yaxis_title="Number of Countries")
+    return fig
+
+
+def whd_dense():
+    whddf = datasets.get("whd")
+    fig = px.treemap(whddf, path=[px.Constant("world"), 'Region', 'Country'], values='Economy (GDP per Capita)',
+                     color='Happiness Score', hover_data=['Economy (GDP per Capita)'],
+                     color_continuous_scale='RdBu',
+                     color_continuous_midpoint=np.average(whddf['Happiness Score'],
+                                                          weights=whddf['Economy (GDP per Capita)']))
+    fig.update_layout(margin=dict(t=50, l=25, r=25, b=25))
+    return fig
+
+
+def whd_main(year=None):
+    whddf = datasets.get("whd")
+    if year is None:
+        frame = dict(data_frame=whddf, animation_frame="Year")
+    else:
+        frame = dict(data_frame=whd_year(year),
+                     range_color=(whddf["Happiness Score"].min(), whddf["Happiness Score"].max()))
+    fig = px.choropleth(locations="iso_alpha",
+                        color="Happiness Score", fitbounds='locations',
+                        hover_name="Country", hover_data=['Economy (GDP per Capita)', 'Family',
+                                                          'Health (Life Expectancy)', 'Freedom',
+                                                          'Trust (Government Corruption)', 'Generosity'],
+                        color_continuous_scale=px.colors.sequential.RdBu, **frame)
+    fig.update_layout(margin=dict(l=0, r=0, t=0, b=0),
+                      legend=dict(orientation='h', y=-0.1, yanchor='bottom', x=0.5, xanchor='center'))
+    return fig
+
+
+def whd_pie():
+    whddf = datasets.get("whd")
+    return px.sunburst(whddf, path=['Region', 'Country'], values='Trust (Government Corruption)',
                        color='Happiness Score', hover_data=['iso_alpha'],
                        color_continuous_scale='RdBu',
                        color_continuous_midpoint=np.average(whddf['Happiness Score'],
                                                             weights=whddf['Trust (Government Corruption)']))
 
-    return fig1, fig2, fig3, fig4, fig5
 
+def whd_scatter(year=None):
+    whddf = datasets.get("whd")
+    if year is None:
+        frame = dict(data_frame=whddf, animation_frame="Year")
+    else:
+        frame = dict(data_frame=whd_year(year), category_orders={'Region': whd_regions()})
+    fig = px.scatter_ternary(a="Generosity", b="Trust (Government Corruption)", c="Freedom",
+                             hover_name="Country", color="Region", size="Happiness Score", size_max=15,
+                             hover_data=['Happiness Score', 'Economy (GDP per Capita)', 'Family',
+                                         'Health (Life Expectancy)', 'Freedom',
+                                         'Trust (Government Corruption)', 'Generosity'],
+                             color_discrete_sequence=px.colors.sequential.Plasma, **frame)
+    if year is not None:
+        # size the markers against every year, like the animation does
+        fig.update_traces(marker_sizeref=whddf["Happiness Score"].max() / 15 ** 2)
+    return fig
+
+
+# helpers for the single year figures
+def whd_years():
+    return sorted(datasets.get("whd")["Year"].unique().tolist())
+
+
+def whd_year(year):
+    whddf = datasets.get("whd")
+    return whddf[whddf["Year"].to_numpy() == year]
+
+
+def whd_regions():
+    # regions in order of first appearance, which is the order the animated figures color them in
+    return pd.unique(datasets.get("whd")["Region"]).tolist()
+
+
+# which function builds each graph of each dataset, and which csv files they come from
+figure_builders = {
+    'mxmh': {'histo': mxmh_histo, 'dense': mxmh_dense, 'main': mxmh_main, 'pie': mxmh_pie, 'scatter': mxmh_scatter},
+    'can': {'histo': can_histo, 'dense': can_dense, 'main': can_main, 'pie': can_pie, 'scatter': can_scatter},
+    'whd19': {'histo': whd19_histo, 'dense': whd19_dense, 'main': whd19_main, 'pie': whd19_pie,
+              'scatter': whd19_scatter},
+    'whd': {'histo': whd_histo, 'dense': whd_dense, 'main': whd_main, 'pie': whd_pie, 'scatter': whd_scatter},
+}
+dataset_sources = {
+    'mxmh': [music_csv],
+    'can': [events_csv, stations_csv],
+    'whd19': [whd_csv],
+    'whd': [whd_csv],
+}
+
+
+# build every figure once so the first visitors get cached figures
+# gunicorn.conf.py runs this in the master before forking, so all workers share the result
+# WARMUP_DATASETS picks which datasets to build (comma separated), default is all of them
+def warmup(names=None):
+    if names is None:
+        names = [name for name in os.environ.get("WARMUP_DATASETS", ",".join(dataset_ids)).split(",") if name]
+    for dataset in names:
+        # one figure at a time, pool threads started in the master would be lost in the workers
+        for graph in graph_ids:
+            render_figure(dataset, graph)
+        if dataset == 'whd' and year_slider:
+            years = whd_years()
+            figure_cache.resize(max(figure_cache.maxsize, warm_figure_count(years) + figure_cache_spare))
+            for year in years:
+                for graph in animated_graphs:
+                    figure_cache.get(('whd', graph, year), partial(figure_builders['whd'][graph], year),
+                                     dataset_sources['whd'])
+
+
+# set once the St. Lawrence figures are in the cache
+initial_figures_ready = threading.Event()
+
+
+# what the background thread does in fast-start mode: the first page's figures, then everything else
+def build_in_background():
+    started = time.perf_counter()
+    px.scatter  # load plotly.express here rather than in whichever request needs it first
+    timeline.mark_since("import plotly.express", started)
+    started = time.perf_counter()
+    warmup(['can'])
+    initial_figures_ready.set()
+    timeline.mark_since("St. Lawrence figures", started)
+    started = time.perf_counter()
+    warmup([dataset for dataset in dataset_ids if dataset != 'can'])
+    timeline.mark_since("other datasets' figures", started)
+    if os.environ.get("STARTUP_REPORT", "0") == "1":
+        print(timeline.report(), file=sys.stderr)
+
+
+@server.route("/_startup")
+def startup_report():
+    return Response(timeline.report(), mimetype="text/plain")
+
+
+timeline.mark("figure builders")
+if fast_start:
+    threading.Thread(target=build_in_background, name="background-build", daemon=True).start()
+else:
+    initial_figures_ready.set()
+if os.environ.get("STARTUP_REPORT", "0") == "1":
+    print(timeline.report(), file=sys.stderr)
 
 # FYI you can't have multiple callbacks with the same id so don't try lol
 
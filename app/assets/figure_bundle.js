@@ -0,0 +1,61 @@
+// Browser side half of PREFETCH_FIGURES mode, see app.py
+// Every dataset's figures are downloaded once from /_figure-bundle/<dataset>.json (gzipped by the server)
+// and kept here, so clicking between datasets after that never goes back to the server.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    figure_bundle: {
+        // dataset -> promise of {graph: figure}
+        bundles: {},
+
+        load: function (config, dataset) {
+            const bundles = window.dash_clientside.figure_bundle.bundles;
+            if (!bundles[dataset]) {
+                bundles[dataset] = fetch(config.url + dataset + ".json")
+                    .then(function (response) {
+                        if (!response.ok) {
+                            throw new Error("could not load figures for " + dataset);
+                        }
+                        return response.json();
+                    })
+                    .catch(function (error) {
+                        // forget the failed download so the next click tries again
+                        delete bundles[dataset];
+                        throw error;
+                    });
+            }
+            return bundles[dataset];
+        },
+
+        prefetch: function (config) {
+            if (!config || !config.enabled) {
+                return window.dash_clientside.no_update;
+            }
+            const figure_bundle = window.dash_clientside.figure_bundle;
+            return new Promise(function (resolve) {
+                // one dataset after another, so the downloads don't compete with the first paint
+                const start = function () {
+                    config.datasets.reduce(function (chain, dataset) {
+                        return chain.then(function (loaded) {
+                            return figure_bundle.load(config, dataset).then(
+                                function () { return loaded.concat([dataset]); },
+                                function () { return loaded; }
+                            );
+                        });
+                    }, Promise.resolve([])).then(resolve);
+                };
+                if (window.requestIdleCallback) {
+                    window.requestIdleCallback(start);
+                } else {
+                    window.setTimeout(start, 500);
+                }
+            });
+        },
+
+        switch_dataset: function (mxmh, can, whd19, whd, config) {
+            // read which button was clicked before waiting on anything, dash clears the context afterwards
+            const dataset = window.dash_clientside.callback_context.triggered_id;
+            return window.dash_clientside.figure_bundle.load(config, dataset).then(function (bundle) {
+                return config.graphs.map(function (graph) { return bundle[graph]; });
+            });
+        }
+    }
+});
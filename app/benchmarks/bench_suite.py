@@ -0,0 +1,255 @@
+# Benchmark suite for the whole app: loading, preprocessing, every figure builder, serialization
+# and full callback round trips through the Flask test client.
+# Run from the app folder: python benchmarks/bench_suite.py [--scales 1,10,100,1000] [--compare results/old.json]
+# Every table is resampled to scale times its rows, so you can see how each step grows with the data.
+# Results are written to benchmarks/results/<date>-<commit>.json, pass one of those to --compare
+# to print how much faster or slower each step got since then.
+# 1000x takes a long while (the map alone has ~1.8M points then), leave it out for a quick run.
+
+import argparse
+import gzip
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from plotly.io.json import to_json_plotly
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+os.chdir(here)
+# time the real work, not the disk store shared between workers
+os.environ["SHARED_CACHE"] = "0"
+
+import app  # noqa: E402
+from cache import serialize_figure  # noqa: E402
+from columnar import read_table, write_table  # noqa: E402
+from cube import EventCube  # noqa: E402
+from features import date_format, parse_dates, season_from_month_day, zscore  # noqa: E402
+from timeindex import EventTimeIndex  # noqa: E402
+
+results_dir = os.path.join(here, "benchmarks", "results")
+
+# raw csv behind each table, the attribute of app.py holding its path and the loader that preprocesses it
+assets = {
+    "events": ("events_csv", app.load_events),
+    "mxmh": ("music_csv", app.load_music),
+    "whd": ("whd_csv", lambda: pd.read_csv(app.whd_csv)),
+    "whd19": ("whd_csv", lambda: app.load_whd_year(2019)),
+}
+
+
+def best_of(func, repeat=3):
+    # smallest wall time out of a few runs, and the result of the last one
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def scaled(df, scale):
+    # scale times the rows, drawn with replacement so the distributions stay the same
+    if scale == 1:
+        return df
+    sample = df.sample(frac=scale, replace=True, random_state=0)
+    # tables indexed by something meaningful (whd19 by country) keep their index
+    return sample.reset_index(drop=True) if isinstance(df.index, pd.RangeIndex) else sample
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def bench_loading(scale, repeat, folder, record):
+    # csv parsing + preprocessing of each asset, and reading it back from the columnar cache
+    tables = {}
+    original = {name: getattr(app, attribute) for name, (attribute, _) in assets.items()}
+    try:
+        for name, (attribute, loader) in assets.items():
+            raw = scaled(pd.read_csv(original[name]), scale)
+            path = os.path.join(folder, f"{name}-{scale}.csv")
+            raw.to_csv(path, index=False)
+            setattr(app, attribute, path)
+            seconds, table = best_of(loader, repeat)
+            record("load", name, seconds, rows=len(table))
+            tables[name] = table
+
+            columnar = os.path.join(folder, f"{name}-{scale}.columnar")
+            start = time.perf_counter()
+            write_table(table, columnar)
+            record("columnar write", name, time.perf_counter() - start)
+            seconds, _ = best_of(lambda: read_table(columnar), repeat)
+            record("columnar read", name, seconds)
+    finally:
+        for name, (attribute, _) in assets.items():
+            setattr(app, attribute, original[name])
+    return tables
+
+
+def bench_features(events, repeat, record):
+    # the derived columns of the event table on their own
+    raw = events["date_start"].dt.strftime(date_format)
+    month = events["month"].to_numpy(dtype=int)
+    day = events["day"].to_numpy(dtype=int)
+    record("features", "parse_dates", best_of(lambda: parse_dates(raw), repeat)[0])
+    record("features", "season_from_month_day", best_of(lambda: season_from_month_day(month, day), repeat)[0])
+    record("features", "zscore", best_of(lambda: zscore(events["max"]), repeat)[0])
+
+    # time windows through the sorted index, against a boolean scan of the table
+    index = EventTimeIndex(events)
+    starts = events["date_start"].to_numpy()
+    window = (np.datetime64("1990-01-01"), np.datetime64("2000-01-01"))
+    record("time index", "build", best_of(lambda: EventTimeIndex(events), repeat)[0])
+    record("time index", "decade, all stations", best_of(lambda: index.between(*window), repeat)[0])
+    record("time index", "decade, 3 stations",
+           best_of(lambda: index.between(*window, stations=app.locations[:3]), repeat)[0])
+    record("time index", "decade, boolean scan",
+           best_of(lambda: np.flatnonzero((starts >= window[0]) & (starts < window[1])), repeat)[0])
+
+    # the bar chart's breakdown from the aggregation cube, against a groupby over the events
+    cube = EventCube(events, app.locations, app.season_order)
+    record("cube", "build", best_of(lambda: EventCube(events, app.locations, app.season_order), repeat)[0])
+    record("cube", "station x season", best_of(lambda: cube.counts(["station_name", "season"]), repeat)[0])
+    record("cube", "domain x station roll-up", best_of(lambda: cube.rollup(["domain", "station_name"]), repeat)[0])
+    record("cube", "station x season, groupby",
+           best_of(lambda: events.groupby(["station_name", "season"]).size(), repeat)[0])
+
+
+def bench_builders(repeat, record):
+    # every graph of every dataset, straight from its builder (no cache), then serialized
+    for dataset, builders in app.figure_builders.items():
+        for graph, build in builders.items():
+            seconds, fig = best_of(build, repeat)
+            record("build", f"{dataset}/{graph}", seconds)
+            seconds, payload = best_of(lambda: serialize_figure(fig), repeat)
+            record("serialize", f"{dataset}/{graph}", seconds, bytes=len(payload),
+                   gzip_bytes=len(gzip.compress(payload, compresslevel=6)))
+
+
+def click(client, dataset, graph):
+    # the request the browser sends for one graph when a dataset button is clicked
+    inputs = [{"id": button, "property": "n_clicks", "value": 1 if button == dataset else None}
+              for button in app.dataset_ids]
+    inputs.append({"id": "whd-year", "property": "value", "value": None})
+    inputs += [{"id": "filter-station", "property": "value", "value": []},
+               {"id": "filter-domain", "property": "value", "value": []},
+               {"id": "filter-season", "property": "value", "value": []},
+               {"id": "filter-dates", "property": "start_date", "value": None},
+               {"id": "filter-dates", "property": "end_date", "value": None}]
+    body = {"output": f"{graph}-graph.figure", "outputs": {"id": f"{graph}-graph", "property": "figure"},
+            "inputs": inputs, "changedPropIds": [f"{dataset}.n_clicks"],
+            "state": [{"id": "client-id", "property": "data", "value": None}]}
+    response = client.post("/_dash-update-component", json=body, headers={"Accept-Encoding": "gzip"})
+    if response.status_code != 200:
+        raise RuntimeError(f"{dataset}/{graph} returned {response.status_code}")
+    return response
+
+
+def bench_round_trips(repeat, record):
+    # the five requests of a dataset switch through Flask, first with empty caches and then cached
+    client = app.server.test_client()
+    for dataset in app.dataset_ids:
+        def switch():
+            return sum(len(click(client, dataset, graph).data) for graph in app.graph_ids)
+
+        app.figure_cache.invalidate()
+        start = time.perf_counter()
+        size = switch()
+        record("round trip cold", dataset, time.perf_counter() - start, bytes=size)
+        seconds, size = best_of(switch, repeat)
+        record("round trip cached", dataset, seconds, bytes=size)
+
+
+def bench_cross_filter(repeat, record):
+    # patches sent to the other four graphs when two stations are picked on one St. Lawrence graph,
+    # serialized like dash does. with and without a date range the aggregation cube can't answer
+    picked = ["Sorel", "Rimouski"]
+    app.figure_cache.invalidate()
+    app.filtered_cache.invalidate()
+    for label, filters in (("", None), (", part of a year", {"start": "1990-03-01", "end": "2010-08-31"})):
+        for origin in app.graph_ids:
+            app.cross_filter_patches(origin, picked, filters)  # the figures themselves are cached after this
+
+            def patches():
+                return to_json_plotly(app.cross_filter_patches(origin, picked, filters))
+            seconds, payload = best_of(patches, repeat)
+            record("cross filter", f"from {origin}{label}", seconds, bytes=len(payload))
+
+
+def run(scales, repeat):
+    results = []
+    for scale in scales:
+        # big tables are slow enough that one run is plenty
+        runs = repeat if scale <= 10 else 1
+
+        def record(section, name, seconds, **extra):
+            results.append(dict(scale=scale, section=section, name=name, seconds=seconds, **extra))
+            size = f"  {extra['bytes'] / 1e3:10.1f} KB" if "bytes" in extra else ""
+            print(f"{scale:>6}x  {section:<18} {name:<28} {seconds * 1000:10.2f} ms{size}", flush=True)
+
+        with tempfile.TemporaryDirectory() as folder:
+            tables = bench_loading(scale, runs, folder, record)
+        bench_features(tables["events"], runs, record)
+
+        # point the app at the scaled tables, the stations lookup stays as it is
+        for name, table in tables.items():
+            app.datasets.register(name, lambda table=table: table)
+        # and rebuild what is derived from the event table from the scaled one
+        for name in ("event_index", "event_filters", "event_cube"):
+            app.datasets.unload(name)
+        bench_builders(runs, record)
+        bench_round_trips(runs, record)
+        bench_cross_filter(runs, record)
+    return results
+
+
+def compare(results, previous_path):
+    with open(previous_path) as f:
+        previous = {(r["scale"], r["section"], r["name"]): r["seconds"] for r in json.load(f)["results"]}
+    print(f"\ncompared with {previous_path} (ratio > 1 means slower now)")
+    for r in results:
+        before = previous.get((r["scale"], r["section"], r["name"]))
+        if before:
+            ratio = r["seconds"] / before
+            flag = "  <-- slower" if ratio > 1.2 else ""
+            print(f"{r['scale']:>6}x  {r['section']:<18} {r['name']:<28} {ratio:8.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time loading, building and serving every figure of the app")
+    parser.add_argument("--scales", default="1,10,100,1000", help="comma separated row multipliers")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the best one is kept")
+    parser.add_argument("--compare", help="results file of an earlier run")
+    parser.add_argument("--no-save", action="store_true", help="don't write the results file")
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(",")]
+    results = run(scales, args.repeat)
+
+    if not args.no_save:
+        os.makedirs(results_dir, exist_ok=True)
+        commit = git_commit()
+        path = os.path.join(results_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+        meta = {"commit": commit, "date": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+                "machine": platform.machine(), "cpus": os.cpu_count(), "numpy": np.__version__,
+                "pandas": pd.__version__, "scales": scales}
+        with open(path, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=1)
+        print(f"\nresults written to {os.path.relpath(path)}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+# Load test for the dash callbacks, to size the deployment before a workshop
+# Run from the app folder: python benchmarks/load_test.py --users 30 --duration 60 --configs 1x4,2x4,4x4
+# For every workers x threads config it starts gunicorn (with gunicorn.conf.py) on a local port,
+# replays simulated sessions against it and prints throughput, p50/p95/p99 latency and errors
+# per request type. Pass --url to test a server that is already running instead.
+#
+# A simulated session does what a browser does:
+#   - load the page: /, /_dash-layout and /_dash-dependencies
+#   - then, after some think time, click a dataset button: one request per graph, sent in parallel
+#   - sometimes click a station on the St. Lawrence treemap (drill_main)
+# Opening and closing the info modals runs in the browser (clientside callbacks), so it only adds think time.
+# --sync makes every session click at the same moment, like a room following the presenter.
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+dataset_ids = ["mxmh", "can", "whd19", "whd"]
+graph_ids = ["histo", "dense", "main", "pie", "scatter"]
+# how often each button gets clicked, the St. Lawrence view is the one people come for
+dataset_weights = [0.2, 0.4, 0.2, 0.2]
+# treemap node ids are "<domain>/<station>", drill_main only looks at the station part
+stations = ["PointeClaire", "MontrealJetee1", "Varennes", "Contrecoeur-IOC", "Sorel", "LacSaintPierre",
+            "Port-Saint-Francois", "TroisRivieres", "Becancour", "Batiscan", "Deschaillons-sur-Saint-Laurent",
+            "Portneuf", "Neuville", "Vieux-Quebec", "Lauzon", "Saint-Laurent-IO", "Saint-Joseph-de-la-Rive",
+            "Rimouski", "Sept-Iles"]
+drill_chance = 0.3
+# the St. Lawrence filter controls, left empty
+no_filters = [{"id": "filter-station", "property": "value", "value": []},
+              {"id": "filter-domain", "property": "value", "value": []},
+              {"id": "filter-season", "property": "value", "value": []},
+              {"id": "filter-dates", "property": "start_date", "value": None},
+              {"id": "filter-dates", "property": "end_date", "value": None}]
+
+
+class Recorder:
+    """
+    Latency and status of every request, grouped by request type
+    """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds, ok):
+        with self.lock:
+            self.latencies[name].append(seconds)
+            if not ok:
+                self.errors[name] += 1
+
+    def summary(self, elapsed):
+        rows = []
+        names = sorted(self.latencies)
+        everything = [seconds for name in names for seconds in self.latencies[name]]
+        for name, latencies in [(name, self.latencies[name]) for name in names] + [("all", everything)]:
+            if not latencies:
+                continue
+            errors = sum(self.errors.values()) if name == "all" else self.errors[name]
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+            rows.append(dict(name=name, requests=len(latencies), errors=errors, rps=len(latencies) / elapsed,
+                             p50_ms=p50, p95_ms=p95, p99_ms=p99))
+        return rows
+
+
+class Session:
+    """
+    One simulated browser tab
+    """
+
+    def __init__(self, url, recorder, pool):
+        self.url = url.rstrip("/")
+        self.recorder = recorder
+        self.pool = pool
+        self.client_id = uuid.uuid4().hex
+        self.clicks = {dataset: 0 for dataset in dataset_ids}
+        self.local = threading.local()
+        # output id of drill_main, it has a hash suffix (allow_duplicate) only known from /_dash-dependencies
+        self.drill_output = None
+
+    def http(self):
+        # one keep-alive connection per thread, like the handful a browser keeps open
+        if not hasattr(self.local, "http"):
+            self.local.http = requests.Session()
+            self.local.http.headers["Accept-Encoding"] = "gzip"
+        return self.local.http
+
+    def request(self, name, method, path, **kwargs):
+        start = time.perf_counter()
+        response = None
+        try:
+            response = self.http().request(method, self.url + path, timeout=60, **kwargs)
+            ok = response.status_code in (200, 204)
+        except requests.RequestException:
+            ok = False
+        self.recorder.add(name, time.perf_counter() - start, ok)
+        return response
+
+    def load_page(self):
+        self.request("page /", "GET", "/")
+        self.request("page layout", "GET", "/_dash-layout")
+        response = self.request("page dependencies", "GET", "/_dash-dependencies")
+        if response is not None and response.status_code == 200:
+            for callback in response.json():
+                if callback["inputs"] == [{"id": "main-graph", "property": "clickData"}]:
+                    self.drill_output = callback["output"]
+
+    def graph_request(self, dataset, graph):
+        inputs = [{"id": button, "property": "n_clicks", "value": self.clicks[button] or None} for button in dataset_ids]
+        inputs.append({"id": "whd-year", "property": "value", "value": None})
+        inputs += no_filters
+        body = {"output": f"{graph}-graph.figure", "outputs": {"id": f"{graph}-graph", "property": "figure"},
+                "inputs": inputs, "changedPropIds": [f"{dataset}.n_clicks"],
+                "state": [{"id": "client-id", "property": "data", "value": self.client_id}]}
+        self.request(f"click {dataset}", "POST", "/_dash-update-component", json=body)
+
+    def click(self, dataset):
+        self.clicks[dataset] += 1
+        futures = [self.pool.submit(self.graph_request, dataset, graph) for graph in graph_ids]
+        for future in futures:
+            future.result()
+
+    def drill(self):
+        if self.drill_output is None:
+            return
+        station = random.choice(stations)
+        body = {"output": self.drill_output, "outputs": {"id": "main-graph", "property": "figure"},
+                "inputs": [{"id": "main-graph", "property": "clickData",
+                            "value": {"points": [{"id": f"1/{station}"}]}}],
+                "changedPropIds": ["main-graph.clickData"], "state": no_filters}
+        self.request("drill station", "POST", "/_dash-update-component", json=body)
+
+
+def run_sessions(url, users, duration, think, sync):
+    recorder = Recorder()
+    # the parallel graph requests of every session go through this pool
+    pool = ThreadPoolExecutor(max_workers=users * len(graph_ids))
+    barrier = threading.Barrier(users) if sync else None
+    stop = time.perf_counter() + duration
+    shared_choice = {}
+
+    def user(index):
+        session = Session(url, recorder, pool)
+        session.load_page()
+        round_number = 0
+        while time.perf_counter() < stop:
+            if barrier is not None:
+                # everybody clicks the same button at the same moment
+                try:
+                    barrier.wait(timeout=think * 4 + 60)
+                except threading.BrokenBarrierError:
+                    return
+                dataset = shared_choice.setdefault(round_number, random.choices(dataset_ids, dataset_weights)[0])
+                round_number += 1
+            else:
+                time.sleep(random.uniform(0, think * 2))
+                dataset = random.choices(dataset_ids, dataset_weights)[0]
+            session.click(dataset)
+            if dataset == "can" and random.random() < drill_chance:
+                time.sleep(random.uniform(0, think))
+                session.drill()
+            if barrier is not None:
+                time.sleep(think)
+        if barrier is not None:
+            barrier.abort()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(index,), daemon=True) for index in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    pool.shutdown()
+    return recorder.summary(elapsed)
+
+
+def start_server(workers, threads, port, extra_env):
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads), **extra_env)
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:server"],
+                              cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 180
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn exited while starting")
+        try:
+            if requests.get(url + "/_dash-layout", timeout=5).status_code == 200:
+                return server, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError("gunicorn did not come up within 3 minutes")
+
+
+def print_rows(label, rows):
+    print(f"\n{label}")
+    print(f"{'request':<20} {'count':>7} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for row in rows:
+        print(f"{row['name']:<20} {row['requests']:>7} {row['errors']:>7} {row['rps']:>8.1f} "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay simulated sessions against the dash callbacks")
+    parser.add_argument("--users", type=int, default=20, help="concurrent sessions")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of clicking per config")
+    parser.add_argument("--think", type=float, default=2, help="average seconds between a session's clicks")
+    parser.add_argument("--sync", action="store_true", help="all sessions click at the same time")
+    parser.add_argument("--configs", default="1x4,2x4", help="gunicorn workers x threads to try, comma separated")
+    parser.add_argument("--url", help="test this running server instead of starting gunicorn")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--env", action="append", default=[], help="extra NAME=value for the server, repeatable")
+    parser.add_argument("--save", action="store_true", help="write the results to benchmarks/results/")
+    args = parser.parse_args()
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    report = {"users": args.users, "duration": args.duration, "think": args.think, "sync": args.sync,
+              "env": extra_env, "runs": []}
+    if args.url:
+        rows = run_sessions(args.url, args.users, args.duration, args.think, args.sync)
+        print_rows(args.url, rows)
+        report["runs"].append({"config": args.url, "rows": rows})
+    else:
+        for config in args.configs.split(","):
+            workers, threads = (int(part) for part in config.split("x"))
+            server, url = start_server(workers, threads, args.port, extra_env)
+            try:
+                rows = run_sessions(url, args.users, args.duration, args.think, args.sync)
+            finally:
+                server.terminate()
+                server.wait()
+            print_rows(f"{workers} workers x {threads} threads, {args.users} users", rows)
+            report["runs"].append({"config": config, "rows": rows})
+
+    if args.save:
+        folder = os.path.join(here, "benchmarks", "results")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"load-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=1)
+        print(f"\nresults written to {os.path.relpath(path)}")
+
+
+if __name__ == '__main__':
+    main()
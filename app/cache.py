@@ -0,0 +1,144 @@
+# Server side cache for the figures returned by the graph callbacks
+# The figures only depend on the csv files in assets/, so once a graph of a dataset has been built
+# a repeat click just looks it up here instead of running plotly.express again
+
+import json
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from coalesce import SingleFlight
+
+# figure: the decoded figure dict handed back to dash
+# payload: the same figure serialized once to JSON bytes
+# signature: (path, mtime, size) of every source file at build time
+# responses: compressed callback responses sending this figure, filled in by compression.py
+CacheEntry = namedtuple("CacheEntry", ["figure", "payload", "signature", "responses"])
+
+
+def file_signature(paths):
+    """
+    Cheap fingerprint of the source files, changes whenever one of them is rewritten
+    """
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+
+def serialize_figure(fig):
+    """
+    Serialize a plotly figure (or figure dict) to JSON bytes
+    """
+    if hasattr(fig, "to_json"):
+        return fig.to_json().encode("utf-8")
+    return json.dumps(fig).encode("utf-8")
+
+
+class FigureCache:
+    """
+    LRU cache of figures keyed by (dataset, graph), invalidated when a source file changes
+    """
+
+    def __init__(self, maxsize=8, shared=None):
+        self.maxsize = maxsize
+        # optional SharedFigureStore, misses go through it so other processes can reuse the figure
+        self.shared = shared
+        # concurrent misses on the same key wait for one build instead of each running it
+        self.flights = SingleFlight()
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, key, signature):
+        # call with the lock held
+        entry = self.entries.get(key)
+        if entry is not None and entry.signature == signature:
+            self.entries.move_to_end(key)
+            return entry
+        self.entries.pop(key, None)
+        return None
+
+    def lookup(self, key, sources=()):
+        # returns the entry if it is still fresh, otherwise drops it and returns None
+        signature = file_signature(sources)
+        with self.lock:
+            entry = self._fresh(key, signature)
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def store(self, key, figure, sources=()):
+        # serialize once, keep both the bytes and the decoded dict
+        return self.store_payload(key, serialize_figure(figure), sources)
+
+    def store_payload(self, key, payload, sources=()):
+        # same as store, for a figure that was already serialized (e.g. in another process)
+        entry = CacheEntry(
+            figure=json.loads(payload),
+            payload=payload,
+            signature=file_signature(sources),
+            responses={},
+        )
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return entry
+
+    def build_payload(self, key, build, sources=()):
+        # JSON bytes of build(), taken from the shared store when another process already made them
+        if self.shared is None:
+            return serialize_figure(build())
+        return self.shared.get(key, file_signature(sources), lambda: serialize_figure(build()))
+
+    def _fill(self, key, build, sources):
+        # the build a previous flight finished just before this one started is good too
+        with self.lock:
+            entry = self._fresh(key, file_signature(sources))
+        if entry is None:
+            entry = self.store_payload(key, self.build_payload(key, build, sources), sources)
+        return entry
+
+    def get_entry(self, key, build, sources=(), cancelled=None):
+        entry = self.lookup(key, sources)
+        if entry is None:
+            entry = self.flights.do(key, lambda: self._fill(key, build, sources), cancelled)
+        return entry
+
+    def get(self, key, build, sources=(), cancelled=None):
+        """
+        Return the cached figure for key, calling build() to make it on a miss
+        cancelled is passed on to SingleFlight.do, see coalesce.py
+        """
+        return self.get_entry(key, build, sources, cancelled).figure
+
+    def get_json(self, key, build, sources=(), cancelled=None):
+        """
+        Same as get but returns the serialized JSON bytes of the figure
+        """
+        return self.get_entry(key, build, sources, cancelled).payload
+
+    def resize(self, maxsize):
+        # the oldest entries go if the cache shrinks
+        with self.lock:
+            self.maxsize = maxsize
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+                if self.shared is not None:
+                    self.shared.clear()
+            else:
+                self.entries.pop(key, None)
@@ -0,0 +1,94 @@
+# Helpers for many users clicking the same thing at the same time
+# SingleFlight: when several requests need the same figure and it isn't cached yet, the first
+#   one builds it and the others wait for that result instead of building it again each.
+# ClickTracker: remembers the newest click of every browser tab, so requests for clicks that
+#   the user already moved on from can give up instead of keeping a thread busy.
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+
+
+class Superseded(Exception):
+    """
+    Raised when the request waiting for a result is no longer wanted
+    """
+
+
+class SingleFlight:
+    """
+    Run fn() once per key at a time, concurrent callers with the same key share the result
+    """
+
+    # how often a waiting caller checks whether it was cancelled, in seconds
+    poll = 0.05
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn, cancelled=None):
+        # cancelled is an optional function returning True once the caller's result isn't needed
+        # a cancelled caller stops waiting (or never starts), a computation already running
+        # is left to finish since the other callers and the cache still want it
+        if cancelled is not None and cancelled():
+            raise Superseded(key)
+        with self.lock:
+            call = self.calls.get(key)
+            owner = call is None
+            if owner:
+                call = self.calls[key] = Future()
+
+        if not owner:
+            while True:
+                try:
+                    return call.result(timeout=self.poll if cancelled is not None else None)
+                except TimeoutError:
+                    if cancelled():
+                        raise Superseded(key)
+
+        try:
+            result = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    def pending(self):
+        with self.lock:
+            return list(self.calls)
+
+
+class ClickTracker:
+    """
+    Newest click number seen from each client, oldest clients are forgotten past maxsize
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.latest = OrderedDict()
+        self.lock = threading.Lock()
+
+    def seen(self, client, clicks):
+        with self.lock:
+            self.latest[client] = max(clicks, self.latest.get(client, clicks))
+            self.latest.move_to_end(client)
+            while len(self.latest) > self.maxsize:
+                self.latest.popitem(last=False)
+
+    def superseded(self, client, clicks):
+        return self.latest.get(client, clicks) > clicks
+
+    def checker(self, client, clicks):
+        """
+        Record this click and return a function telling whether a newer one came in since
+        """
+        if client is None:
+            return None
+        self.seen(client, clicks)
+        return lambda: self.superseded(client, clicks)
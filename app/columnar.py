@@ -0,0 +1,154 @@
+# Binary columnar cache for the tables read from assets/*.csv
+# The first time a table is loaded it is parsed and preprocessed as usual, then every column is
+# written as its own .npy file in .cache/columnar/<name>-<hash>/ (COLUMNAR_DIR)
+# After that, each new process memory-maps those files instead of parsing text again.
+# The hash covers the bytes of every source csv plus a preprocessing version number,
+# so editing a csv or bumping the version makes the old copy stale automatically.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# outside of assets/, which dash serves to anyone and its hot reloader watches
+cache_dir = os.environ.get("COLUMNAR_DIR", os.path.join(".cache", "columnar"))
+
+# bump this if the on-disk layout written below changes
+format_version = 1
+
+
+def source_digest(sources, version):
+    """
+    Hash of the source files' contents and the preprocessing version
+    """
+    digest = hashlib.sha256(f"{format_version}:{version}".encode())
+    for path in sources:
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:20]
+
+
+def _is_default_index(index):
+    return isinstance(index, pd.RangeIndex) and index.start == 0 and index.step == 1 and index.name is None
+
+
+def _encode_column(values):
+    # returns (kind, arrays to save, extra metadata) for one column
+    if values.dtype == object:
+        codes, uniques = pd.factorize(values)
+        if not all(isinstance(u, str) for u in uniques):
+            raise TypeError("only string object columns can be cached")
+        categories = np.asarray(uniques, dtype=str) if len(uniques) else np.array([], dtype="U1")
+        return "strings", {"codes": codes.astype(np.int32), "categories": categories}
+    if isinstance(values.dtype, np.dtype) and values.dtype.kind in "biufM":
+        return "array", {"values": np.ascontiguousarray(values)}
+    raise TypeError(f"unsupported dtype {values.dtype}")
+
+
+def _decode_column(kind, folder, prefix):
+    if kind == "array":
+        return np.load(os.path.join(folder, f"{prefix}.values.npy"), mmap_mode="r")
+    codes = np.load(os.path.join(folder, f"{prefix}.codes.npy"), mmap_mode="r")
+    categories = np.load(os.path.join(folder, f"{prefix}.categories.npy")).astype(object)
+    # -1 marks missing values, same as pd.factorize
+    values = np.append(categories, np.nan)[codes]
+    return values
+
+
+def write_table(df, folder):
+    """
+    Write a DataFrame as one .npy file per column plus a meta.json describing them
+    """
+    if _is_default_index(df.index):
+        index_names = []
+        table = df
+    else:
+        index_names = list(df.index.names)
+        table = df.reset_index(names=[f"__index_{i}__" for i in range(len(index_names))])
+
+    parent = os.path.dirname(folder)
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    try:
+        columns = []
+        for i, name in enumerate(table.columns):
+            kind, arrays = _encode_column(table[name].to_numpy())
+            for part, array in arrays.items():
+                np.save(os.path.join(staging, f"c{i}.{part}.npy"), array, allow_pickle=False)
+            columns.append({"name": name, "kind": kind})
+        meta = {"columns": columns, "index_names": index_names, "rows": len(table)}
+        with open(os.path.join(staging, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        # the rename is atomic, if another worker got there first we keep theirs
+        try:
+            os.rename(staging, folder)
+        except OSError:
+            pass
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def read_table(folder):
+    """
+    Memory-map a table written by write_table back into a DataFrame
+    Numeric and datetime columns stay views of their files, string columns are decoded into memory
+    """
+    with open(os.path.join(folder, "meta.json")) as f:
+        meta = json.load(f)
+    index_names = meta["index_names"]
+    stored = [f"__index_{i}__" for i in range(len(index_names))]
+    data = {}
+    for i, column in enumerate(meta["columns"]):
+        data[column["name"]] = _decode_column(column["kind"], folder, f"c{i}")
+
+    index = None
+    if index_names:
+        levels = [data.pop(name) for name in stored]
+        index = pd.MultiIndex.from_arrays(levels, names=index_names) if len(levels) > 1 else \
+            pd.Index(levels[0], name=index_names[0])
+    # a dict with copy=False gives every column its own block, so the numeric ones stay backed by
+    # the memory-mapped files and the pages are shared by every process reading the table. building
+    # the frame any other way (or set_index on it afterwards) merges the columns of the same dtype
+    # into new in-memory arrays
+    return pd.DataFrame(data, index=index, copy=False)
+
+
+def _remove_stale(name, keep):
+    # drop older copies of the same table so the folder does not keep growing
+    if not os.path.isdir(cache_dir):
+        return
+    for entry in os.listdir(cache_dir):
+        if entry.startswith(f"{name}-") and entry != keep:
+            shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+
+
+def cached_table(name, sources, build, version=1):
+    """
+    Return the table called name, built with build() from the files in sources
+    A fresh copy on disk is memory-mapped, otherwise build() runs and the result is written out
+    """
+    try:
+        folder_name = f"{name}-{source_digest(sources, version)}"
+    except OSError:
+        return build()
+    folder = os.path.join(cache_dir, folder_name)
+    if os.path.exists(os.path.join(folder, "meta.json")):
+        try:
+            return read_table(folder)
+        except (OSError, ValueError, KeyError):
+            shutil.rmtree(folder, ignore_errors=True)
+
+    df = build()
+    try:
+        write_table(df, folder)
+        _remove_stale(name, folder_name)
+    except (OSError, TypeError):
+        # the cache is only an optimization, a read-only disk or odd dtype just means no cache
+        pass
+    return df
@@ -0,0 +1,115 @@
+# Compression for the callback responses
+# A dataset switch sends each graph's whole figure back as JSON, a few hundred KB that compress
+# about 5-10x. The figures come out of the figure cache already serialized, so rather than letting
+# dash encode the figure dict again on every request, a callback returns cached_json(entry): dash only
+# encodes a short placeholder and the hook below pastes the cached bytes in its place. The compressed
+# response is kept on the cache entry itself, so the next request for the same figure is answered
+# without encoding, hashing or compressing anything. Other responses are compressed as they are.
+# No ETags here: browsers never make a POST conditional. The figure bundles (GET) have their own in app.py.
+# Brotli is used when the brotli package is installed and the browser accepts it, gzip otherwise.
+
+import gzip
+import hashlib
+import uuid
+
+from flask import g, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def content_etag(body):
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def pick_encoding(accept_encodings):
+    """
+    Best content encoding the client accepts, or None to send the body as is
+    """
+    if brotli is not None and "br" in accept_encodings:
+        return "br"
+    if "gzip" in accept_encodings:
+        return "gzip"
+    return None
+
+
+class CachedJSON:
+    """
+    Callback return value standing for a cache entry's JSON bytes, see ResponseCompressor.cached_json
+    """
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.marker = f"__cached_json_{uuid.uuid4().hex}__"
+
+    def to_plotly_json(self):
+        # this is what dash encodes, the hook swaps it (quotes included) for the real bytes
+        return self.marker
+
+
+class ResponseCompressor:
+    """
+    after_request hook sending the cached figures and compressing the responses of the given paths
+    """
+
+    def __init__(self, paths, minimum_size=1024):
+        self.paths = set(paths)
+        # small responses (a PreventUpdate, a modal style) aren't worth it
+        self.minimum_size = minimum_size
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, server):
+        server.after_request(self.after_request)
+
+    def cached_json(self, entry):
+        """
+        Return this from a callback instead of entry.figure, entry is a CacheEntry (see cache.py)
+        """
+        placeholder = CachedJSON(entry)
+        g.setdefault("cached_json", []).append(placeholder)
+        return placeholder
+
+    def after_request(self, response):
+        placeholders = g.pop("cached_json", [])
+        if (request.path not in self.paths or response.status_code != 200 or response.direct_passthrough
+                or "Content-Encoding" in response.headers):
+            return response
+        body = response.get_data()
+        encoding = pick_encoding(request.accept_encodings)
+        response.vary.add("Accept-Encoding")
+
+        if len(placeholders) == 1:
+            # one figure: the few bytes dash wrapped around it plus the cached JSON, compressed once per wrapper
+            placeholder = placeholders[0]
+            prefix, suffix = body.split(f'"{placeholder.marker}"'.encode(), 1)
+            if encoding is None:
+                response.set_data(prefix + placeholder.entry.payload + suffix)
+                return response
+            key = (prefix, suffix, encoding)
+            data = placeholder.entry.responses.get(key)
+            if data is None:
+                self.misses += 1
+                data = placeholder.entry.responses[key] = compress(prefix + placeholder.entry.payload + suffix,
+                                                                   encoding)
+            else:
+                self.hits += 1
+            response.set_data(data)
+            response.headers["Content-Encoding"] = encoding
+            return response
+
+        for placeholder in placeholders:
+            body = body.replace(f'"{placeholder.marker}"'.encode(), placeholder.entry.payload, 1)
+        if encoding is not None and len(body) >= self.minimum_size:
+            body = compress(body, encoding)
+            response.headers["Content-Encoding"] = encoding
+        response.set_data(body)
+        return response
@@ -0,0 +1,130 @@
+# Linked selection between the St. Lawrence figures
+# Clicking a station (or box / lasso selecting points) on one figure narrows the other figures down to
+# the stations picked. The figures are already cached for the current filters, so instead of building
+# them again the server sends dash Patches that only carry what changes:
+#   - the bar chart, ternary plot and map have one trace per station, only their visible flags change
+#   - the heatmap has one column per station, its counts come back with the other columns zeroed
+#   - the treemap boxes are rolled up again from the aggregation cube (app.py does that part)
+# Which traces / columns belong to which station is worked out once per cached figure (StationSlices).
+# app.py wires it to the graphs, see cross_filter.
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from dash import Patch
+
+
+class StationSlices:
+    """
+    The traces (one per station) or heatmap columns (one per station label) of a figure dict, by station
+    """
+
+    def __init__(self, figure, label_stations):
+        data = figure.get("data", [])
+        self.label_stations = label_stations
+        self.traces = {}
+        self.columns = {}
+        self.z = None
+        if data and data[0].get("type") == "heatmap":
+            self.z = np.asarray(data[0]["z"])
+            for column, label in enumerate(data[0]["x"]):
+                station = label_stations.get(label)
+                if station is not None:
+                    self.columns.setdefault(station, []).append(column)
+        else:
+            self.names = [trace.get("name") for trace in data]
+            for index, name in enumerate(self.names):
+                self.traces.setdefault(name, []).append(index)
+
+    def stations_of(self, points):
+        """
+        Stations of the clicked or selected points, None if none of them is a station
+        """
+        stations = set()
+        for point in points:
+            if self.z is not None:
+                station = self.label_stations.get(point.get("x"))
+            else:
+                curve = point.get("curveNumber")
+                station = self.names[curve] if isinstance(curve, int) and 0 <= curve < len(self.names) else None
+            if station is not None:
+                stations.add(station)
+        return stations or None
+
+    def patch(self, stations=None):
+        """
+        Patch that shows only these stations, or all of them again when stations is None
+        """
+        patch = Patch()
+        if self.z is not None:
+            z = self.z
+            if stations is not None:
+                keep = np.zeros(z.shape[1], dtype=bool)
+                for station in stations:
+                    keep[self.columns.get(station, [])] = True
+                z = np.where(keep, z, 0)
+            patch["data"][0]["z"] = z.tolist()
+        else:
+            # legendonly rather than hidden, so the legend still says which stations are left out
+            for name, indices in self.traces.items():
+                for index in indices:
+                    patch["data"][index]["visible"] = True if stations is None or name in stations else "legendonly"
+        return patch
+
+
+class SliceCache:
+    """
+    StationSlices of the last few cached figures, rebuilt when the figure cache hands out a new figure
+    """
+
+    def __init__(self, label_stations, maxsize=32):
+        self.label_stations = label_stations
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, figure):
+        with self.lock:
+            entry = self.entries.get(key)
+            # the figure cache keeps the same dict until the figure is rebuilt
+            if entry is not None and entry[0] is figure:
+                self.entries.move_to_end(key)
+                return entry[1]
+        slices = StationSlices(figure, self.label_stations)
+        with self.lock:
+            self.entries[key] = (figure, slices)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return slices
+
+
+def treemap_stations(points, domain_stations):
+    """
+    Stations of the clicked treemap nodes: a domain box stands for all of its stations
+    Node ids are "<domain>", "<domain>/<station>" or "<domain>/<station>/<event>"
+    """
+    stations = set()
+    for point in points:
+        parts = str(point.get("id", "")).split("/")
+        if len(parts) > 1:
+            stations.add(parts[1])
+        elif parts[0].isdigit():
+            stations.update(domain_stations.get(int(parts[0]), []))
+    return stations or None
+
+
+def copy_patch(figure, paths):
+    """
+    Patch setting every path (a tuple of keys like ("data", 0, "ids")) to its value in figure
+    A path missing from figure is set to None, which drops it from the graph's figure
+    """
+    patch = Patch()
+    for path in paths:
+        value, target = figure, patch
+        for key in path[:-1]:
+            value = value[key] if isinstance(value, list) else (value or {}).get(key)
+            target = target[key]
+        target[path[-1]] = (value or {}).get(path[-1])
+    return patch
@@ -0,0 +1,160 @@
+# Pre-aggregated cube of the water level events
+# Instead of a groupby over the whole event table for every breakdown, the events are summed once
+# into a small dense array with one cell per (station, season, year, domain). Any breakdown over
+# those dimensions (per station and season for the bar chart, per domain and station for the
+# treemap, with or without filters) is then a slice and a sum over a few thousand cells.
+# app.py builds it once per load of the event table (see the "event_cube" dataset).
+
+import numpy as np
+import pandas as pd
+
+from filters import filter_columns
+
+dimensions = ["station_name", "season", "year", "domain"]
+# per cell: count, and sum/min/max of each of these columns
+measures = ["max", "mean", "days"]
+# every column rollup can return
+all_columns = ["count"] + [f"{measure}_{stat}" for measure in measures for stat in ("sum", "min", "max", "mean")] \
+    + ["max*days_sum"]
+
+
+class EventCube:
+    """
+    Count and sum/min/max of max, mean and days for every station x season x year x domain
+    """
+
+    def __init__(self, localdf, stations, seasons):
+        # stations and seasons fix the order of those axes (and so of every roll-up)
+        self.labels = {
+            "station_name": list(stations),
+            "season": list(seasons),
+            "year": list(range(int(localdf["year"].min()), int(localdf["year"].max()) + 1)) if len(localdf) else [],
+            "domain": sorted(pd.unique(localdf["domain"]).tolist()),
+        }
+        self.shape = tuple(len(self.labels[dimension]) for dimension in dimensions)
+
+        codes = [pd.Index(self.labels[dimension]).get_indexer(localdf[dimension]) for dimension in dimensions]
+        known = np.logical_and.reduce([code >= 0 for code in codes]) if codes else np.zeros(0, dtype=bool)
+        flat = np.ravel_multi_index([code[known] for code in codes], self.shape)
+        size = int(np.prod(self.shape))
+
+        self.count = np.bincount(flat, minlength=size).reshape(self.shape)
+        self.sum, self.min, self.max = {}, {}, {}
+        for measure in measures:
+            values = localdf[measure].to_numpy(dtype=float)[known]
+            self.sum[measure] = np.bincount(flat, weights=values, minlength=size).reshape(self.shape)
+            low = np.full(size, np.inf)
+            np.minimum.at(low, flat, values)
+            self.min[measure] = low.reshape(self.shape)
+            high = np.full(size, -np.inf)
+            np.maximum.at(high, flat, values)
+            self.max[measure] = high.reshape(self.shape)
+        # for the days-weighted average of max the treemap colors are centered on
+        self.sum["max*days"] = np.bincount(
+            flat, weights=(localdf["max"].to_numpy(dtype=float) * localdf["days"].to_numpy(dtype=float))[known],
+            minlength=size).reshape(self.shape)
+
+    @staticmethod
+    def supports(filters):
+        """
+        True if filters can be answered from the cube, i.e. the date range covers whole years
+        """
+        if not filters:
+            return True
+        start, end = filters.get("start"), filters.get("end")
+        return (start is None or start[4:] == "-01-01") and (end is None or end[4:] == "-12-31")
+
+    def _selection(self, filters):
+        # positions to keep along each axis
+        selection = [np.arange(length) for length in self.shape]
+        if not filters:
+            return selection
+        for name, column in filter_columns.items():
+            if name in filters:
+                axis = dimensions.index(column)
+                wanted = set(filters[name])
+                selection[axis] = np.array([i for i, label in enumerate(self.labels[column]) if label in wanted],
+                                           dtype=int)
+        years = self.labels["year"]
+        first = int(filters["start"][:4]) if filters.get("start") else None
+        last = int(filters["end"][:4]) if filters.get("end") else None
+        selection[dimensions.index("year")] = np.array([i for i, year in enumerate(years)
+                                 if (first is None or year >= first) and (last is None or year <= last)], dtype=int)
+        return selection
+
+    def _reducer(self, by, selection):
+        # reduce(array, ufunc, initial) sums (or mins / maxes) a cube-shaped array down to the axes in by
+        axes = [dimensions.index(dimension) for dimension in by]
+        other = tuple(axis for axis in range(len(dimensions)) if axis not in axes)
+        # only the filtered axes are indexed, so the unfiltered roll-ups don't copy the cube first
+        taken = [(axis, keep) for axis, keep in enumerate(selection) if len(keep) < self.shape[axis]]
+        # after reducing, the axes left are in cube order, this puts them in the order of by
+        order = list(np.argsort(np.argsort(axes)))
+
+        def reduce(array, ufunc, initial):
+            for axis, keep in taken:
+                array = array.take(keep, axis=axis)
+            # initial keeps min / max defined when a filter leaves an axis empty
+            reduced = ufunc.reduce(array, axis=other, initial=initial) if other else array
+            return np.moveaxis(reduced, order, list(range(len(axes))))
+        return reduce
+
+    def _labels(self, by, selection):
+        return [[self.labels[dimension][i] for i in selection[dimensions.index(dimension)]] for dimension in by]
+
+    def counts(self, by, filters=None):
+        """
+        Number of events per combination of the dimensions in by, as a dense array (zeros included)
+        Returns the array and the labels along each of its axes
+        """
+        selection = self._selection(filters)
+        return self._reducer(by, selection)(self.count, np.add, 0), self._labels(by, selection)
+
+    def rollup(self, by, filters=None, columns=None):
+        """
+        DataFrame indexed by the dimensions in by, one row per combination with at least one event
+        columns picks which of count, <measure>_sum/_min/_max/_mean and max*days_sum to compute, default all
+        """
+        selection = self._selection(filters)
+        reduce = self._reducer(by, selection)
+        count = reduce(self.count, np.add, 0)
+        cells = np.nonzero(count > 0)
+        reduced = {"count": count[cells]}
+        stats = {"sum": (self.sum, np.add, 0), "min": (self.min, np.minimum, np.inf),
+                 "max": (self.max, np.maximum, -np.inf)}
+
+        def column(name):
+            if name not in reduced:
+                measure, stat = name.rsplit("_", 1)
+                if stat == "mean":
+                    reduced[name] = column(f"{measure}_sum") / reduced["count"]
+                else:
+                    arrays, ufunc, initial = stats[stat]
+                    reduced[name] = reduce(arrays[measure], ufunc, initial)[cells]
+            return reduced[name]
+
+        names = all_columns if columns is None else columns
+        data = {name: column(name) for name in names}
+
+        # the selected labels of each axis are the levels, the cell positions along it the codes
+        levels = self._labels(by, selection)
+        if len(by) > 1:
+            index = pd.MultiIndex(levels=levels, codes=list(cells), names=by, verify_integrity=False)
+        else:
+            index = pd.Index(levels[0], name=by[0])[cells[0]]
+        return pd.DataFrame(data, index=index, columns=list(names))
+
+    def total(self, filters=None):
+        """
+        Totals over every cell matching filters, as a dict like one row of rollup
+        """
+        index = np.ix_(*self._selection(filters))
+        count = int(self.count[index].sum())
+        totals = {"count": count}
+        for measure in measures:
+            totals[f"{measure}_sum"] = float(self.sum[measure][index].sum())
+            totals[f"{measure}_min"] = float(self.min[measure][index].min(initial=np.inf))
+            totals[f"{measure}_max"] = float(self.max[measure][index].max(initial=-np.inf))
+            totals[f"{measure}_mean"] = totals[f"{measure}_sum"] / count if count else np.nan
+        totals["max*days_sum"] = float(self.sum["max*days"][index].sum())
+        return totals
@@ -0,0 +1,59 @@
+# Registry of the tables behind each dataset button
+# Nothing is read until the first callback asks for a table, so a worker only pays
+# (in startup time and memory) for the datasets its users actually look at.
+
+import threading
+
+from cache import file_signature
+
+
+class DatasetRegistry:
+    """
+    Load each registered table once, on first use, and reload it if its source files change
+    """
+
+    def __init__(self):
+        self.loaders = {}
+        self.sources = {}
+        self.tables = {}
+        self.signatures = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def register(self, name, loader, sources=()):
+        # loader is called with no arguments and returns the preprocessed DataFrame
+        with self.lock:
+            self.loaders[name] = loader
+            self.sources[name] = list(sources)
+            self.locks[name] = threading.Lock()
+            self.tables.pop(name, None)
+            self.signatures.pop(name, None)
+
+    def get(self, name):
+        """
+        Return the table called name, loading it first if needed
+        """
+        signature = file_signature(self.sources[name])
+        if name in self.tables and self.signatures[name] == signature:
+            return self.tables[name]
+
+        # only one thread loads a given table, the others wait for it and reuse the result
+        with self.locks[name]:
+            if name in self.tables and self.signatures[name] == signature:
+                return self.tables[name]
+            table = self.loaders[name]()
+            self.signatures[name] = signature
+            self.tables[name] = table
+            return table
+
+    def loaded(self):
+        return [name for name in self.loaders if name in self.tables]
+
+    def unload(self, name=None):
+        with self.lock:
+            if name is None:
+                self.tables.clear()
+                self.signatures.clear()
+            else:
+                self.tables.pop(name, None)
+                self.signatures.pop(name, None)
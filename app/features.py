@@ -0,0 +1,85 @@
+# Derived columns for the water level event table
+# Everything in here works on whole columns at a time (no row-by-row .apply),
+# so the cost grows linearly with the number of events instead of quadratically.
+# app.py calls add_event_features once after reading the csv
+
+import numpy as np
+import pandas as pd
+
+# Season boundaries written as month * 100 + day
+# spring starts 03/20, summer 06/21, autumn 09/22 and winter 12/21
+season_starts = [320, 621, 922, 1221]
+# np.searchsorted gives 0 before the first boundary and 4 after the last one, both are winter
+season_names = np.array(['Winter', 'Spring', 'Summer', 'Autumn', 'Winter'], dtype=object)
+
+# every date in the event csv looks like "02/26/1960 23:00"
+date_format = "%m/%d/%Y %H:%M"
+date_columns = ['date_start', 'date_end', 'date_max']
+
+
+def season_from_month_day(month, day):
+    """
+    Season of every event, takes integer arrays of months and days
+    """
+    key = np.asarray(month) * 100 + np.asarray(day)
+    return season_names[np.searchsorted(season_starts, key, side='right')]
+
+
+def parse_dates(column):
+    """
+    Parse a column of date_format strings to datetime64, each distinct string only once
+    """
+    # events of different stations share a lot of timestamps, so there are far fewer distinct
+    # strings than rows, and parsing with an explicit format skips pandas' format guessing
+    codes, uniques = pd.factorize(column)
+    parsed = pd.to_datetime(pd.Series(uniques), format=date_format).to_numpy()
+    values = parsed[codes]
+    # -1 codes are missing dates
+    values[codes < 0] = np.datetime64("NaT")
+    return pd.Series(values, index=column.index, name=column.name)
+
+
+def zscore(column):
+    """
+    Standardize a column with the population standard deviation (ddof=0)
+    """
+    values = column.to_numpy(dtype=float)
+    return (values - values.mean()) / values.std()
+
+
+def add_event_features(localdf, label_to_group, location_rank):
+    """
+    Compute every derived column of the event table in one columnar pass
+    The date columns become datetime64, with year/month/day of the start as small integers
+    Returns a new DataFrame sorted by station rank, the input is left untouched
+    Events without a start date are dropped
+    """
+    dates = {name: parse_dates(localdf[name]) for name in date_columns}
+    # an event that never started has no season, year or place in the time index (NaT would be cast to
+    # year 0, month 0, day 0 below and counted as winter), so it is left out of the table altogether
+    started = dates['date_start'].notna().to_numpy()
+    if not started.all():
+        localdf = localdf[started]
+        dates = {name: column[started] for name, column in dates.items()}
+    start = dates['date_start'].dt
+    month = start.month.to_numpy(dtype=np.int8)
+    day = start.day.to_numpy(dtype=np.int8)
+
+    days = localdf['duration'] / 24
+
+    localdf = localdf.assign(
+        **dates,
+        year=start.year.to_numpy(dtype=np.int16),
+        month=month,
+        day=day,
+        season=season_from_month_day(month.astype(int), day.astype(int)),
+        days=days,
+        domain=localdf['stn_lab'].map(label_to_group),
+        max_std=zscore(localdf['max']),
+        days_std=zscore(days),
+        mean_std=zscore(localdf['mean']),
+        rank=localdf['station_name'].map(location_rank),
+    )
+
+    # Sort the DataFrame by the 'rank' column
+    return localdf.sort_values("rank")
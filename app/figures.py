@@ -0,0 +1,305 @@
+# Figure builders shared by the module level figures and the update_* callbacks in app.py
+# These take the data they need as arguments so they can be reused for any slice of the tables
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from features import date_format
+from startup import lazy_import
+
+px = lazy_import("plotly.express")
+
+
+def build_station_map(localdf, lookup, locations, location_colors):
+    """
+    Build the St. Lawrence map with one Scattergeo trace per station
+    Every event of a station is a point of that trace, sized by its peak water level
+    """
+    fig = go.Figure()
+
+    # one groupby for the whole table instead of filtering localdf once per station
+    station_rows = localdf.groupby('station_name', sort=False).indices
+    coords = lookup.drop_duplicates('station_name').set_index('station_name')[['lat', 'lon']]
+
+    # rounding keeps the json small, the hover only shows 3 decimals anyway
+    hover_columns = ['duration', 'max', 'mean', 'min']
+    hover_values = localdf[hover_columns].to_numpy(dtype=float).round(3)
+    stn_lab = localdf['stn_lab'].to_numpy()
+    peak = hover_values[:, 1]
+
+    for station in locations:
+        rows = station_rows.get(station)
+        if rows is None or station not in coords.index:
+            continue
+        n_events = len(rows)
+        fig.add_trace(go.Scattergeo(
+            lon=np.repeat(coords.at[station, 'lon'], n_events),
+            lat=np.repeat(coords.at[station, 'lat'], n_events),
+            customdata=hover_values[rows],
+            hovertemplate=(
+                f"<b>{stn_lab[rows[0]]}</b><br>"
+                "Duration (h): %{customdata[0]:.0f}<br>"
+                "Max: %{customdata[1]:.3f}<br>"
+                "Mean: %{customdata[2]:.3f}<br>"
+                "Min: %{customdata[3]:.3f}"
+            ),
+            marker=dict(
+                size=peak[rows],
+                color=location_colors[station],
+                line_color='rgb(40,40,40)',
+                line_width=0.5,
+                sizemode='area'),
+            legendgroup='station_name',
+            name=station))
+
+    fig.update_layout(
+        title_text='Locations on the St. Lawrence',
+        showlegend=True,
+        geo=dict(
+            landcolor='rgb(217, 217, 217)',
+            projection_scale=30,
+            center=dict(lat=lookup['lat'].iloc[2], lon=lookup['lon'].iloc[2]),  # this will center on the point
+        )
+    )
+    return fig
+
+
+def nice_bin_edges(values, nbins=None):
+    """
+    Bin edges with a round bin size (1, 2 or 5 times a power of ten), at most about nbins bins
+    Close to what plotly.js picks when it bins a histogram itself, including its default when nbins is None
+    """
+    lo, hi = float(np.min(values)), float(np.max(values))
+    if hi == lo:
+        return np.array([lo - 0.5, lo + 0.5])
+    if nbins:
+        raw = (hi - lo) / nbins
+    else:
+        # plotly.js scales the default bin size off the standard deviation, but never below the data resolution
+        distinct = np.unique(values)
+        raw = max(np.diff(distinct).min(), 2 * np.std(values) / len(values) ** 0.4)
+    magnitude = 10 ** np.floor(np.log10(raw))
+    size = next(m * magnitude for m in (1, 2, 5, 10) if m * magnitude >= raw)
+    start = np.floor(lo / size) * size
+    count = int(np.floor((hi - start) / size)) + 1
+    return start + size * np.arange(count + 1)
+
+
+def _axis_bins(values, nbins, order=None):
+    # numeric columns get round bins, anything else gets one bin per category
+    # returns the positions to histogram, the bin edges, and the labels to show on the axis
+    if values.dtype.kind in "biuf":
+        values = values.astype(float)
+        finite = values[np.isfinite(values)]
+        edges = nice_bin_edges(finite, nbins) if len(finite) else np.array([0.0, 1.0])
+        return values, edges, np.round((edges[:-1] + edges[1:]) / 2, 10)
+    present = set(pd.unique(values))
+    categories = [c for c in (order or []) if c in present]
+    categories += [c for c in pd.unique(values) if c not in set(categories)]
+    codes = pd.Categorical(values, categories=categories).codes.astype(float)
+    codes[codes < 0] = np.nan
+    return codes, np.arange(len(categories) + 1) - 0.5, categories
+
+
+def build_density_heatmap(df, x, y, nbinsx, nbinsy, facet_row=None, facet_col=None, **px_kwargs):
+    """
+    Same figure as px.density_heatmap, but the counts are binned here with numpy
+    Only the count grid of each facet goes to the browser, not the raw rows
+    """
+    facets = [column for column in (facet_row, facet_col) if column is not None]
+    category_orders = px_kwargs.get("category_orders") or {}
+    xpos, xedges, xlabels = _axis_bins(df[x].to_numpy(), nbinsx, category_orders.get(x))
+    ypos, yedges, ylabels = _axis_bins(df[y].to_numpy(), nbinsy, category_orders.get(y))
+
+    # let plotly express lay out the facets, axes and color axis from one row per facet,
+    # the row number is stored in x so each trace can be matched back to its facet
+    if facets:
+        combos = df[facets].drop_duplicates().reset_index(drop=True)
+    else:
+        combos = pd.DataFrame(index=[0])
+    skeleton = combos.assign(**{x: np.arange(len(combos)), y: np.arange(len(combos))})
+    fig = px.density_heatmap(skeleton, x=x, y=y, facet_row=facet_row, facet_col=facet_col, **px_kwargs)
+
+    keep = np.isfinite(xpos) & np.isfinite(ypos)
+    traces = []
+    for trace in fig.data:
+        combo = combos.iloc[int(trace.x[0])]
+        mask = keep.copy()
+        for column in facets:
+            mask &= df[column].to_numpy() == combo[column]
+        counts, _, _ = np.histogram2d(xpos[mask], ypos[mask], bins=[xedges, yedges])
+        traces.append(go.Heatmap(
+            x=xlabels,
+            y=ylabels,
+            z=counts.T.astype(int),
+            coloraxis=trace.coloraxis,
+            xaxis=trace.xaxis,
+            yaxis=trace.yaxis,
+            hovertemplate=trace.hovertemplate,
+            name=trace.name))
+    fig.data = []
+    fig.add_traces(traces)
+    return fig
+
+
+def build_aggregated_histogram(df, x, y=None, histfunc="count", color=None, animation_frame=None, nbins=None,
+                               bin_edges=None, **px_kwargs):
+    """
+    Same figure as px.histogram, but counts / averages are computed here with one groupby
+    Each trace (and each animation frame) only carries one bar per bin or category
+    bin_edges fixes the bins of a numeric x, e.g. to keep them the same across separately built years
+    """
+    group_columns = [column for column in (animation_frame, color) if column is not None]
+    value_columns = [x] + ([y] if y is not None else [])
+
+    # let plotly express lay out traces, colors, legend and animation controls from the first row of each group
+    skeleton = df.drop_duplicates(group_columns)[group_columns + value_columns] if group_columns else df.head(1)
+    fig = px.histogram(skeleton, x=x, y=y, histfunc=histfunc, color=color, animation_frame=animation_frame,
+                       **px_kwargs)
+
+    xvalues = df[x].to_numpy()
+    numeric = xvalues.dtype.kind in "biuf"
+    yvalues = df[y].to_numpy() if y is not None else 1
+    if numeric:
+        # rows without an x (NaN, inf) go in no bar, like px.histogram drops them
+        keep = np.isfinite(xvalues)
+        if not keep.all():
+            df, xvalues = df[keep], xvalues[keep]
+            yvalues = yvalues[keep] if y is not None else 1
+        if bin_edges is not None:
+            edges = np.asarray(bin_edges, dtype=float)
+        else:
+            edges = nice_bin_edges(xvalues, nbins) if len(xvalues) else np.array([0.0, 1.0])
+        bins = np.clip(np.searchsorted(edges, xvalues, side="right") - 1, 0, len(edges) - 2)
+        binned = df[group_columns].assign(_bin=bins)
+        bin_labels = np.round((edges[:-1] + edges[1:]) / 2, 10)
+        width = round(float(edges[1] - edges[0]), 10)
+    else:
+        binned = df[group_columns].assign(_bin=xvalues)
+        width = None
+
+    grouped = binned.assign(_y=yvalues).groupby(group_columns + ["_bin"], sort=False)
+    if histfunc == "count":
+        aggregated = grouped.size()
+    elif histfunc == "sum":
+        aggregated = grouped["_y"].sum()
+    elif histfunc == "avg":
+        aggregated = grouped["_y"].mean()
+    elif histfunc == "min":
+        aggregated = grouped["_y"].min()
+    elif histfunc == "max":
+        aggregated = grouped["_y"].max()
+    else:
+        raise ValueError(f"unsupported histfunc {histfunc}")
+
+    # (frame, color) -> (x, y) of the bars, keyed by the names plotly express gave the traces and frames
+    bars = {}
+    for key, value in aggregated.items():
+        key = dict(zip(group_columns + ["_bin"], key if isinstance(key, tuple) else (key,)))
+        group = (str(key.get(animation_frame, "")), str(key.get(color, "")))
+        bars.setdefault(group, ([], []))
+        bars[group][0].append(key["_bin"])
+        bars[group][1].append(value)
+
+    def to_bar(trace, frame_name):
+        xs, ys = bars.get((frame_name, trace.legendgroup or ""), ([], []))
+        if numeric:
+            order = np.argsort(xs)
+            xs, ys = bin_labels[np.asarray(xs, dtype=int)[order]], np.asarray(ys)[order]
+        properties = trace.to_plotly_json()
+        for key in ("type", "x", "y", "histfunc", "bingroup", "nbinsx", "xbins", "autobinx"):
+            properties.pop(key, None)
+        return go.Bar(x=xs, y=ys, width=width, **properties)
+
+    first_frame = str(skeleton[animation_frame].iloc[0]) if animation_frame is not None else ""
+    data = [to_bar(trace, first_frame) for trace in fig.data]
+    frames = [go.Frame(data=[to_bar(trace, frame.name) for trace in frame.data], name=frame.name)
+              for frame in fig.frames]
+    fig.data = []
+    fig.add_traces(data)
+    fig.frames = frames
+    if not numeric:
+        # categories appear in the same order plotly.js would give the raw rows
+        fig.update_xaxes(categoryorder="array", categoryarray=list(pd.unique(
+            pd.concat([binned.loc[binned[color].astype(str) == trace.legendgroup, "_bin"] if color else binned["_bin"]
+                       for trace in fig.data]))))
+    return fig
+
+
+def treemap_midpoint(max_days_sum, days_sum, max_sum, count):
+    """
+    Color midpoint of the event treemap: the average peak weighted by event length in days
+    Events that start and end in the same hour weigh nothing, when all of them do it's the plain average
+    """
+    if days_sum > 0:
+        return max_days_sum / days_sum
+    return max_sum / count if count else None
+
+
+def build_event_treemap(localdf, station=None, colorscale='aggrnyl', title=None, aggregates=None):
+    """
+    Treemap of domain -> station -> event, with only the events of one station (or none) as leaves
+    The domain and station boxes are aggregated here, so the first figure grows with the number of
+    stations, not the number of events. Passing station expands that station and zooms into it.
+    aggregates is an already computed (domains, stations, cmid), each frame with count, max, days and
+    mean columns, indexed by domain and by (domain, station_name)
+    """
+    ids, labels, parents, values, colors, customdata = [], [], [], [], [], []
+
+    def add_nodes(node_ids, node_labels, node_parents, grouped, dates):
+        ids.extend(node_ids)
+        labels.extend(node_labels)
+        parents.extend(node_parents)
+        values.extend(grouped["count"].tolist())
+        colors.extend(grouped["max"].tolist())
+        customdata.extend(zip(dates, np.round(grouped["days"], 3).tolist(), np.round(grouped["mean"], 3).tolist()))
+
+    # boxes are sized by number of events and colored by the average peak, same as plotly express would
+    if aggregates is None:
+        aggregations = dict(count=("max", "size"), max=("max", "mean"), days=("days", "mean"), mean=("mean", "mean"))
+        domains = localdf.groupby("domain", sort=False).agg(**aggregations)
+        stations = localdf.groupby(["domain", "station_name"], sort=False).agg(**aggregations)
+        peaks, days = localdf["max"].to_numpy(dtype=float), localdf["days"].to_numpy(dtype=float)
+        cmid = treemap_midpoint(float(peaks @ days), float(days.sum()), float(peaks.sum()), len(peaks))
+    else:
+        domains, stations, cmid = aggregates
+
+    domain_ids = [str(domain) for domain in domains.index]
+    add_nodes(domain_ids, domain_ids, [""] * len(domains), domains, ["(?)"] * len(domains))
+    station_ids = [f"{domain}/{name}" for domain, name in stations.index]
+    add_nodes(station_ids, [name for _, name in stations.index], [str(domain) for domain, _ in stations.index],
+              stations, ["(?)"] * len(stations))
+
+    level = None
+    if station is not None:
+        events = localdf[localdf["station_name"].to_numpy() == station]
+        if len(events):
+            parent = f"{events['domain'].iloc[0]}/{station}"
+            level = parent
+            leaves = pd.DataFrame({"count": 1, "max": events["max"].to_numpy(), "days": events["days"].to_numpy(),
+                                   "mean": events["mean"].to_numpy()})
+            add_nodes([f"{parent}/{ind}" for ind in events["ind_in_stn"]],
+                      [str(ind) for ind in events["ind_in_stn"]],
+                      [parent] * len(events), leaves, events["date_max"].dt.strftime(date_format).tolist())
+
+    fig = go.Figure(go.Treemap(
+        ids=ids,
+        labels=labels,
+        parents=parents,
+        values=values,
+        branchvalues="total",
+        level=level,
+        marker=dict(colors=np.round(colors, 4), coloraxis="coloraxis"),
+        customdata=customdata,
+        hovertemplate="labels=%{label}<br>count=%{value}<br>parent=%{parent}<br>id=%{id}<br>"
+                      "date_max=%{customdata[0]}<br>days=%{customdata[1]}<br>mean=%{customdata[2]}<br>"
+                      "max=%{color}<extra></extra>"))
+    fig.update_layout(
+        coloraxis=dict(colorscale=colorscale, colorbar=dict(title=dict(text="max")),
+                       cmid=cmid),
+        legend=dict(tracegroupgap=0),
+        margin=dict(t=60),
+        title=title,
+    )
+    return fig
@@ -0,0 +1,118 @@
+# Station / domain / season / date range filters for the St. Lawrence view
+# Every value of the filtered columns gets a precomputed bitmap (one bit per event, packed 8 per
+# byte) when the event table is loaded. A request then only ORs the bitmaps of the values picked
+# in each control and ANDs the controls together, the date range comes from the sorted time index.
+# No pass over the DataFrame itself is needed to find the matching events.
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+# filter name -> column of the event table it selects on
+filter_columns = {"stations": "station_name", "domains": "domain", "seasons": "season"}
+
+
+def normalize_filters(stations=None, domains=None, seasons=None, start=None, end=None):
+    """
+    Filters as a dict with sorted values and without the empty ones, None if nothing is filtered
+    start and end are "YYYY-MM-DD" strings, end included. A date that doesn't parse is left out
+    """
+    filters = {}
+    for name, values in (("stations", stations), ("domains", domains), ("seasons", seasons)):
+        if values:
+            filters[name] = sorted(values, key=str)
+    for name, value in (("start", start), ("end", end)):
+        day = parse_day(value)
+        if day is not None:
+            filters[name] = day
+    return filters or None
+
+
+def parse_day(value):
+    # "YYYY-MM-DD" of a date picker value (a date, or a date with a time after it), None if it isn't one
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(str(value)[:10]).isoformat()
+    except ValueError:
+        return None
+
+
+def filter_key(filters):
+    # hashable version of normalize_filters' result, used in the figure cache keys
+    if not filters:
+        return None
+    return tuple((name, tuple(value) if isinstance(value, list) else value) for name, value in sorted(filters.items()))
+
+
+def describe(filters, default_period="1970-2022"):
+    """
+    Text for the figure titles: the period, plus what else is filtered in brackets
+    """
+    if not filters:
+        return default_period
+    start, end = filters.get("start"), filters.get("end")
+    if start and end:
+        period = f"{start} to {end}"
+    elif start:
+        period = f"from {start}"
+    elif end:
+        period = f"until {end}"
+    else:
+        period = default_period
+    parts = []
+    if "stations" in filters:
+        stations = filters["stations"]
+        parts.append(stations[0] if len(stations) == 1 else f"{len(stations)} stations")
+    if "domains" in filters:
+        parts.append("domain " + ", ".join(str(domain) for domain in filters["domains"]))
+    if "seasons" in filters:
+        parts.append(", ".join(filters["seasons"]))
+    return period + (f" ({'; '.join(parts)})" if parts else "")
+
+
+class EventFilterIndex:
+    """
+    Packed bitmaps of the events per station, domain and season, combined into a row mask per request
+    """
+
+    def __init__(self, localdf, time_index):
+        self.size = len(localdf)
+        self.time_index = time_index
+        self.bitmaps = {}
+        for name, column in filter_columns.items():
+            codes, values = pd.factorize(localdf[column])
+            self.bitmaps[name] = {value: np.packbits(codes == code) for code, value in enumerate(values.tolist())}
+
+    def _any_of(self, name, values):
+        # OR of the bitmaps of the picked values, an unknown value matches nothing
+        bitmaps = self.bitmaps[name]
+        selected = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        for value in values:
+            bitmap = bitmaps.get(value)
+            if bitmap is not None:
+                selected |= bitmap
+        return selected
+
+    def mask(self, filters):
+        """
+        Boolean mask of the events matching filters (from normalize_filters), None when nothing is filtered
+        """
+        if not filters:
+            return None
+        packed = None
+        for name in filter_columns:
+            if name in filters:
+                selected = self._any_of(name, filters[name])
+                packed = selected if packed is None else packed & selected
+        mask = None if packed is None else np.unpackbits(packed, count=self.size).astype(bool)
+
+        if "start" in filters or "end" in filters:
+            end = filters.get("end")
+            # the date picker's end day is included, the index windows are [start, end)
+            end = pd.Timestamp(end) + pd.Timedelta(days=1) if end else None
+            in_range = np.zeros(self.size, dtype=bool)
+            in_range[self.time_index.between(filters.get("start"), end)] = True
+            mask = in_range if mask is None else mask & in_range
+        return mask
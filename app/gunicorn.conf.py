@@ -0,0 +1,62 @@
+# gunicorn settings for production, used by the Procfile (gunicorn -c gunicorn.conf.py app:server)
+# The app is imported once in the master (preload_app) and every figure is built there before the
+# workers are forked, so the tables and cached figures are shared copy-on-write instead of each
+# worker reading the csv files and running plotly again on its first requests.
+
+import gc
+import multiprocessing
+import os
+import shutil
+
+# the workers pool their /metrics numbers here, see metrics.py (not under assets/, dash serves that folder)
+os.environ.setdefault("METRICS_DIR", os.path.join(".cache", "metrics"))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8050')}"
+
+# FAST_START=1 skips all of this: each worker imports the app itself, serves placeholder graphs
+# right away and builds the figures in the background (the shared figure store keeps the workers
+# from building the same figure twice)
+fast_start = os.environ.get("FAST_START", "0") == "1"
+preload_app = not fast_start
+
+# WEB_CONCURRENCY is what Heroku-style platforms set from the dyno size
+workers = int(os.environ.get("WEB_CONCURRENCY", min(2 * multiprocessing.cpu_count() + 1, 8)))
+# threads so a worker can answer the other graphs while one figure is being built
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# the first uncached whd figure can take a few seconds
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+keepalive = 5
+
+# recycle workers now and then so a slow leak can't grow forever, jitter so they don't all restart at once
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = 100
+
+
+def when_ready(server):
+    # runs in the master after the app has been preloaded and before the workers exist
+    if fast_start:
+        # nothing was preloaded, only clear the numbers of a previous run (app.metrics_registry doesn't exist here)
+        shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
+        return
+    import app
+
+    app.metrics_registry.clear_directory()
+    if os.environ.get("WARMUP", "1") != "0":
+        server.log.info("warming up figures")
+        app.warmup()
+        server.log.info("warmed up %d figures", len(app.figure_cache.entries))
+        # the workers start with copies of these counters, don't report the warmup once per worker
+        app.figure_cache.hits = app.figure_cache.misses = 0
+
+    # move everything allocated so far out of the gc's reach, otherwise the first collection in each
+    # worker touches every object's header and the shared pages get copied anyway
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # so /metrics lists every worker's memory from the start, not only the ones that served a callback
+    import app
+
+    app.metrics_registry.flush(force=True)
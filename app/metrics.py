@@ -0,0 +1,291 @@
+# Callback timings and sizes in the Prometheus text format, served on /metrics
+# For every request to _dash-update-component three phases are timed:
+#   compute   - the callback itself (building or fetching the figure)
+#   serialize - from the callback returning to the response being ready (dash's JSON encoding + compression)
+#   transfer  - from the response being ready until the server finished sending it
+# plus the size of the response body. Everything is labelled by callback, dataset and graph.
+#
+# With several gunicorn workers a scrape only reaches one of them, so every worker writes its
+# numbers to a file in a shared folder every few seconds and /metrics adds all the files up.
+# The counters of workers that are gone (recycled after max_requests, crashed) are folded into one
+# retired.json there and their own files removed, so the folder doesn't grow with every restart.
+# No prometheus_client needed, the format is simple enough to write by hand.
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+
+try:
+    import fcntl
+except ImportError:  # windows, where gunicorn doesn't run anyway
+    fcntl = None
+
+latency_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+size_buckets = (1e3, 1e4, 3e4, 1e5, 3e5, 1e6, 3e6, 1e7)
+retired_file = "retired.json"
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (key + '="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms of one process, optionally merged with the other workers' on render
+    """
+
+    def __init__(self, directory=None, flush_interval=5):
+        # (family, suffix, labels) -> value, a histogram is just a set of these counters
+        self.series = {}
+        self.families = {}
+        # functions called on render/flush returning [(family, labels dict, value)]
+        self.collectors = []
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.flushed = 0
+        self.lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def describe(self, family, kind, text):
+        # kind is counter, gauge or histogram
+        self.families[family] = (kind, text)
+
+    def collect(self, collector):
+        self.collectors.append(collector)
+
+    def inc(self, family, labels, amount=1, suffix=""):
+        key = (family, suffix, _labels(labels))
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def observe(self, family, labels, value, buckets=latency_buckets):
+        labels = _labels(labels)
+        with self.lock:
+            for bound in buckets + (float("inf"),):
+                if value <= bound:
+                    key = (family, "_bucket", labels + (("le", f"{bound:g}" if bound != float("inf") else "+Inf"),))
+                    self.series[key] = self.series.get(key, 0) + 1
+            for suffix, amount in (("_sum", value), ("_count", 1)):
+                key = (family, suffix, labels)
+                self.series[key] = self.series.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            series = [[family, suffix, list(labels), value] for (family, suffix, labels), value in self.series.items()]
+        for collector in self.collectors:
+            for family, labels, value in collector():
+                series.append([family, "", list(_labels(labels)), value])
+        return {"pid": os.getpid(), "series": series}
+
+    def flush(self, force=False):
+        # write this process's numbers for the others to read, at most every flush_interval seconds
+        if self.directory is None or (not force and time.monotonic() - self.flushed < self.flush_interval):
+            return
+        self.flushed = time.monotonic()
+        self._write(f"{os.getpid()}.json", self.snapshot())
+
+    def _write(self, entry, snapshot):
+        path = os.path.join(self.directory, entry)
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump(snapshot, f)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+    def _read(self, entry):
+        try:
+            with open(os.path.join(self.directory, entry)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @contextmanager
+    def _locked(self):
+        # one process at a time reads the folder, so two scrapes can't retire the same worker twice
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, "metrics.lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _retire(self, retired, dead):
+        # add the dead workers' counters and histograms to the retired ones, their gauges mean nothing anymore
+        totals = {(family, suffix, tuple(tuple(label) for label in labels)): value
+                  for family, suffix, labels, value in retired["series"]}
+        for snapshot in dead:
+            for family, suffix, labels, value in snapshot["series"]:
+                if self.families.get(family, ("untyped", ""))[0] == "gauge":
+                    continue
+                key = (family, suffix, tuple(tuple(label) for label in labels))
+                totals[key] = totals.get(key, 0) + value
+        return {"pid": None,
+                "series": [[family, suffix, list(labels), value] for (family, suffix, labels), value in totals.items()]}
+
+    def clear_directory(self):
+        # numbers left over from a previous run of the server
+        if self.directory is None:
+            return
+        for entry in os.listdir(self.directory):
+            try:
+                os.unlink(os.path.join(self.directory, entry))
+            except OSError:
+                pass
+
+    def snapshots(self):
+        # this process live, the other live workers from their files, the dead ones from retired.json
+        snapshots = [self.snapshot()]
+        if self.directory is None:
+            return snapshots
+        with self._locked():
+            retired = self._read(retired_file) or {"pid": None, "series": []}
+            dead = {}
+            for entry in os.listdir(self.directory):
+                if not entry.endswith(".json") or entry in (f"{os.getpid()}.json", retired_file):
+                    continue
+                snapshot = self._read(entry)
+                if snapshot is None:
+                    continue
+                if _alive(snapshot["pid"]):
+                    snapshots.append(snapshot)
+                else:
+                    dead[entry] = snapshot
+            if dead:
+                # written before the files go, a crash in between counts them twice rather than losing them
+                retired = self._retire(retired, dead.values())
+                self._write(retired_file, retired)
+                for entry in dead:
+                    try:
+                        os.unlink(os.path.join(self.directory, entry))
+                    except OSError:
+                        pass
+        snapshots.append(retired)
+        return snapshots
+
+    def render(self):
+        """
+        All series in the Prometheus text exposition format
+        """
+        totals = {}
+        for snapshot in self.snapshots():
+            for family, suffix, labels, value in snapshot["series"]:
+                key = (family, suffix, tuple(tuple(label) for label in labels))
+                totals[key] = totals.get(key, 0) + value
+
+        lines = []
+        for family, (kind, text) in sorted(self.families.items()):
+            keys = sorted(key for key in totals if key[0] == family)
+            if not keys:
+                continue
+            lines.append(f"# HELP {family} {text}")
+            lines.append(f"# TYPE {family} {kind}")
+            for key in keys:
+                value = totals[key]
+                value = int(value) if float(value).is_integer() else value
+                lines.append(f"{family}{key[1]}{_format_labels(key[2])} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def resident_memory():
+    # resident set size of this process in bytes, linux only (0 elsewhere)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+class CallbackMetrics:
+    """
+    Flask hooks timing the callback requests, see the top of this file for the phases
+    """
+
+    def __init__(self, registry, paths):
+        self.registry = registry
+        self.paths = set(paths)
+        registry.describe("dash_callback_duration_seconds", "histogram",
+                          "Time spent per callback request, split by phase")
+        registry.describe("dash_callback_response_bytes", "histogram",
+                          "Size of the callback response body as sent (after compression)")
+        registry.collect(lambda: [("process_resident_memory_bytes", {"pid": os.getpid()}, resident_memory())])
+        registry.describe("process_resident_memory_bytes", "gauge", "Resident memory of each worker process")
+
+    def init_app(self, server, endpoint="/metrics"):
+        # register this before anything else that changes the response (compression),
+        # flask runs after_request hooks in reverse order so this one then sees the final body
+        server.before_request(self.before_request)
+        server.after_request(self.after_request)
+        server.add_url_rule(endpoint, "metrics", self.metrics_view)
+
+    @contextmanager
+    def compute(self, callback, **labels):
+        """
+        Time the body of a callback, labels (dataset, graph) are attached to every phase of the request
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            g.callback_labels = dict(callback=callback, **labels)
+            g.compute_seconds = time.perf_counter() - started
+            g.compute_finished = time.perf_counter()
+
+    def before_request(self):
+        g.request_started = time.perf_counter()
+
+    def after_request(self, response):
+        if request.path not in self.paths:
+            return response
+        ready = time.perf_counter()
+        labels = getattr(g, "callback_labels", None)
+        if labels is None:
+            # not instrumented with compute(), label it by the output it updates
+            body = request.get_json(silent=True) or {}
+            labels = {"callback": body.get("output", "unknown")}
+            compute_finished = ready
+        else:
+            self.registry.observe("dash_callback_duration_seconds", dict(labels, phase="compute"), g.compute_seconds)
+            compute_finished = g.compute_finished
+        self.registry.observe("dash_callback_duration_seconds", dict(labels, phase="serialize"), ready - compute_finished)
+        if not response.direct_passthrough:
+            self.registry.observe("dash_callback_response_bytes", labels, len(response.get_data()), size_buckets)
+
+        registry = self.registry
+
+        def finished():
+            registry.observe("dash_callback_duration_seconds", dict(labels, phase="transfer"), time.perf_counter() - ready)
+            registry.flush()
+
+        response.call_on_close(finished)
+        return response
+
+    def metrics_view(self):
+        self.registry.flush(force=True)
+        return Response(self.registry.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,137 @@
+# Opt-in sampling profiler for slow callbacks
+# Set PROFILE_DIR to a folder to turn it on. While a wrapped call runs, a background thread looks at
+# its thread's stack every PROFILE_INTERVAL_MS (default 5) and counts where it is. Nothing is traced,
+# so the call itself runs at full speed, and any number of concurrent requests are watched at once.
+# If the call took longer than PROFILE_THRESHOLD_MS (default 500), its samples are written to the folder:
+#   <time>-<name>-<labels>-<ms>ms-<pid>.txt     the labels and the top functions, by total and by own time
+#   <time>-<name>-<labels>-<ms>ms-<pid>.folded  every stack seen and how often, open with speedscope
+#                                               or flamegraph.pl for a flame graph
+# Fast calls are thrown away, so the folder only fills up with the requests worth looking at.
+# Time is counted in samples, so calls shorter than a few intervals only give a rough picture.
+
+import io
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+profile_dir = os.environ.get("PROFILE_DIR")
+threshold = float(os.environ.get("PROFILE_THRESHOLD_MS", 500)) / 1000
+interval = float(os.environ.get("PROFILE_INTERVAL_MS", 5)) / 1000
+
+
+class _Recording:
+    # the stacks seen so far in one profiled call, each a tuple of code objects from the outermost call in
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.stacks = Counter()
+        self.started = time.perf_counter()
+
+
+# thread id -> recording of the call that thread is running. A call made inside an already profiled
+# one (a build inside a callback) just shows up in the outer recording
+_recordings = {}
+_lock = threading.Lock()
+# set while there is something to sample, so the sampler sleeps when nothing is profiled
+_wake = threading.Event()
+# the sampler thread runs in this process, threads don't survive gunicorn forking the workers
+_sampler_pid = None
+
+
+def _sample_forever():
+    while True:
+        _wake.wait()
+        time.sleep(interval)
+        frames = sys._current_frames()
+        with _lock:
+            if not _recordings:
+                _wake.clear()
+            for ident, recording in _recordings.items():
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                if stack:
+                    recording.stacks[tuple(reversed(stack))] += 1
+        del frames
+
+
+def _start_sampler():
+    # called with _lock held, False if no thread can be started (the call then just isn't profiled)
+    global _sampler_pid
+    if _sampler_pid != os.getpid():
+        try:
+            threading.Thread(target=_sample_forever, name="profile-sampler", daemon=True).start()
+        except RuntimeError:
+            return False
+        _sampler_pid = os.getpid()
+    return True
+
+
+@contextmanager
+def profiled(name, **labels):
+    """
+    Sample the body of the with block, keeping the result only if it was slow
+    labels (dataset, graph, ...) end up in the file names and at the top of the .txt
+    """
+    ident = threading.get_ident()
+    # only this thread adds or removes its own entry, no lock needed to check it
+    if profile_dir is None or ident in _recordings:
+        yield
+        return
+    recording = _Recording(name, labels)
+    with _lock:
+        started = _start_sampler()
+        if started:
+            _recordings[ident] = recording
+            _wake.set()
+    if not started:
+        yield
+        return
+    try:
+        yield
+    finally:
+        with _lock:
+            del _recordings[ident]
+        elapsed = time.perf_counter() - recording.started
+        if elapsed >= threshold:
+            _write(recording, elapsed)
+
+
+def _describe(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _write(recording, elapsed):
+    labels = [str(value) for _, value in sorted(recording.labels.items())]
+    parts = [time.strftime("%Y%m%d-%H%M%S"), recording.name] + labels
+    stem = os.path.join(profile_dir, "-".join(parts) + f"-{elapsed * 1000:.0f}ms-{os.getpid()}")
+    total, own = Counter(), Counter()
+    for stack, count in recording.stacks.items():
+        for code in set(stack):
+            total[code] += count
+        own[stack[-1]] += count
+
+    samples = sum(own.values())
+    text = io.StringIO()
+    text.write(f"{recording.name} {recording.labels} took {elapsed * 1000:.0f} ms (pid {os.getpid()}), "
+               f"{samples} samples\n")
+    # a busy process gives the sampler fewer turns than one every interval, so shares rather than times
+    for title, counts in (("total time (the function and what it calls)", total), ("own time", own)):
+        text.write(f"\ntop functions by {title}\n{'samples':>8} {'share':>6}  function\n")
+        for code, count in counts.most_common(40):
+            text.write(f"{count:>8} {count / samples:>6.0%}  {_describe(code)}\n")
+    try:
+        os.makedirs(profile_dir, exist_ok=True)
+        with open(stem + ".txt", "w") as f:
+            f.write(text.getvalue())
+        with open(stem + ".folded", "w") as f:
+            for stack, count in recording.stacks.items():
+                f.write(";".join(_describe(code) for code in stack) + f" {count}\n")
+    except OSError:
+        # a full or read-only disk shouldn't break the request being profiled
+        pass
@@ -0,0 +1,93 @@
+# Figure store on local disk shared by every worker process
+# FigureCache keeps figures per process, so with several gunicorn workers each one would build
+# the same figures again. This store sits behind it: the first worker to miss builds the figure
+# and writes its JSON to .cache/figures/, the others wait on a file lock and read those bytes.
+# Files are plain JSON in the page cache, so reading one is about as cheap as a memory copy.
+# No server is needed, only a directory every worker can see.
+
+import hashlib
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # windows, no cross-process locking there, workers may build a figure twice
+    fcntl = None
+
+
+def _digest(value):
+    return hashlib.sha256(repr(value).encode()).hexdigest()[:24]
+
+
+class SharedFigureStore:
+    """
+    Serialized figures on disk, built once across processes with a per-key file lock
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, key, signature):
+        # one lock file per key, one payload file per (key, source files) version
+        name = _digest(key)
+        return (os.path.join(self.directory, f"{name}.lock"),
+                os.path.join(self.directory, f"{name}-{_digest(signature)}.json"))
+
+    def read(self, key, signature):
+        _, path = self._paths(key, signature)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def get(self, key, signature, build):
+        """
+        Return the payload for key, calling build() (returns JSON bytes) if no process has built it yet
+        """
+        payload = self.read(key, signature)
+        if payload is not None:
+            return payload
+
+        lock_path, path = self._paths(key, signature)
+        with open(lock_path, "a") as lock:
+            # one writer per key, everybody else blocks here until the file exists
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                payload = self.read(key, signature)
+                if payload is None:
+                    payload = build()
+                    self._write(path, payload)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        return payload
+
+    def _write(self, path, payload):
+        # write next to the target and rename, so readers never see half a file
+        fd, staging = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            os.replace(staging, path)
+        except OSError:
+            os.unlink(staging)
+            return
+        # older versions of the same key (from before a csv changed) are dead now
+        prefix = os.path.basename(path).split("-")[0] + "-"
+        for entry in os.listdir(self.directory):
+            if entry.startswith(prefix) and entry != os.path.basename(path):
+                try:
+                    os.unlink(os.path.join(self.directory, entry))
+                except OSError:
+                    pass
+
+    def clear(self):
+        for entry in os.listdir(self.directory):
+            if entry.endswith(".json"):
+                try:
+                    os.unlink(os.path.join(self.directory, entry))
+                except OSError:
+                    pass
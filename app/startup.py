@@ -0,0 +1,70 @@
+# Startup timeline and fast-start helpers
+# app.py marks the end of each startup phase on the timeline (imports, tables, figures, layout...)
+# so the time it takes a fresh worker to come up can be broken down. The report is printed
+# when STARTUP_REPORT=1 and always available on /_startup.
+#
+# FAST_START=1 is for scaling out on new containers: nothing heavy happens at import time,
+# the page is served right away with placeholder graphs and the figures are built in a
+# background thread (see the end of app.py).
+
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+fast_start = os.environ.get("FAST_START", "0") == "1"
+
+
+class StartupTimeline:
+    """
+    Named phases of the startup, each one lasting from the previous mark to its own
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.phases = []
+        self.lock = threading.Lock()
+
+    def mark(self, name):
+        # end of a phase of the import, which runs in one thread
+        now = time.perf_counter()
+        with self.lock:
+            self.phases.append((name, now - self.last, now - self.started, threading.current_thread().name))
+            self.last = now
+
+    def mark_since(self, name, started):
+        # a phase that ran on its own thread, from started (a perf_counter value) until now
+        now = time.perf_counter()
+        with self.lock:
+            self.phases.append((name, now - started, now - self.started, threading.current_thread().name))
+
+    def report(self):
+        lines = [f"startup timeline (pid {os.getpid()}, fast start {'on' if fast_start else 'off'})"]
+        with self.lock:
+            phases = sorted(self.phases, key=lambda phase: phase[2])
+        for name, duration, at, thread in phases:
+            lines.append(f"{at * 1000:9.1f} ms  {duration * 1000:9.1f} ms  {name}"
+                         + ("" if thread == "MainThread" else f"  [{thread}]"))
+        return "\n".join(lines) + "\n"
+
+
+timeline = StartupTimeline()
+
+
+def lazy_import(name):
+    """
+    import name, but in fast-start mode only load it the first time one of its attributes is used
+    """
+    if not fast_start:
+        return importlib.import_module(name)
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,85 @@
+# Shared setup for the tests
+# Run from the app folder: python -m pytest tests
+# The app reads its csv files relative to the app folder, so the tests run from there too.
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+os.chdir(here)
+# keep the figures in memory, a disk store would carry them over from one test to the next
+os.environ["SHARED_CACHE"] = "0"
+
+filter_ids = [("filter-station", "value"), ("filter-domain", "value"), ("filter-season", "value"),
+              ("filter-dates", "start_date"), ("filter-dates", "end_date")]
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.server.test_client()
+
+
+@pytest.fixture
+def click_graph(app_module, client):
+    """
+    Send the request the browser sends for one graph, returns the Flask response
+    """
+
+    def click(graph, dataset="can", clicks=1, client_id=None, filters=(None, None, None, None, None), changed=None,
+              headers=None):
+        inputs = [{"id": button, "property": "n_clicks", "value": clicks if button == dataset else None}
+                  for button in app_module.dataset_ids]
+        inputs.append({"id": "whd-year", "property": "value", "value": None})
+        inputs += [{"id": component, "property": prop, "value": value}
+                   for (component, prop), value in zip(filter_ids, filters)]
+        body = {"output": f"{graph}-graph.figure", "outputs": {"id": f"{graph}-graph", "property": "figure"},
+                "inputs": inputs, "changedPropIds": [changed or f"{dataset}.n_clicks"],
+                "state": [{"id": "client-id", "property": "data", "value": client_id}]}
+        return client.post("/_dash-update-component", json=body, headers=headers)
+    return click
+
+
+# a small event table with the same columns as the real one, for the cube / filter / time index tests
+stations = ["Upstream", "Middle", "Lake", "Estuary", "Gulf"]
+labels = ["ups", "mid", "lak", "est", "gul"]
+groups = {"ups": 1, "mid": 1, "lak": 2, "est": 3, "gul": 3}
+station_rank = {station: rank + 1 for rank, station in enumerate(stations)}
+
+
+@pytest.fixture(scope="session")
+def raw_events():
+    from features import date_format
+
+    rng = np.random.default_rng(0)
+    size = 600
+    start = pd.Timestamp("1990-01-01") + pd.to_timedelta(rng.integers(0, 11 * 365 * 24, size), unit="h")
+    duration = rng.integers(0, 500, size)
+    which = rng.integers(0, len(stations), size)
+    return pd.DataFrame({
+        "date_start": start.strftime(date_format),
+        "date_end": (start + pd.to_timedelta(duration, unit="h")).strftime(date_format),
+        "date_max": start.strftime(date_format),
+        "duration": duration,
+        "max": rng.uniform(1, 5, size),
+        "mean": rng.uniform(0, 3, size),
+        "station_name": np.array(stations)[which],
+        "stn_lab": np.array(labels)[which],
+    })
+
+
+@pytest.fixture(scope="session")
+def events(raw_events):
+    from features import add_event_features
+
+    return add_event_features(raw_events, groups, station_rank)
@@ -0,0 +1,57 @@
+import threading
+import time
+
+import pytest
+
+from coalesce import ClickTracker, SingleFlight, Superseded
+
+
+def test_single_flight_builds_once():
+    flights = SingleFlight()
+    calls = []
+
+    def build():
+        calls.append(1)
+        time.sleep(0.1)
+        return "figure"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do("key", build))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["figure"] * 8
+    assert len(calls) == 1
+    assert flights.pending() == []
+
+
+def test_single_flight_cancelled_caller_gives_up():
+    with pytest.raises(Superseded):
+        SingleFlight().do("key", lambda: "figure", cancelled=lambda: True)
+
+
+def test_click_tracker_newer_click_supersedes():
+    tracker = ClickTracker()
+    first = tracker.checker("page", 1)
+    assert not first()
+    tracker.checker("page", 2)
+    assert first()
+    # other pages are not affected
+    assert not tracker.checker("other", 1)()
+    assert tracker.checker(None, 1) is None
+
+
+def test_reload_is_not_superseded(app_module, click_graph):
+    # the page id lives in memory, so a reloaded page comes back with a new one
+    store = app_module.app.layout["client-id"]
+    assert store.storage_type == "memory"
+
+    for clicks in range(1, 11):
+        assert click_graph("histo", clicks=clicks, client_id="before-reload").status_code == 200
+    # after the reload the buttons count from 0 again, a filter change must still be answered
+    filters = (["Sorel"], None, ["Winter"], None, None)
+    for graph in app_module.graph_ids:
+        response = click_graph(graph, clicks=None, client_id="after-reload", filters=filters,
+                               changed="filter-season.value")
+        assert response.status_code == 200
@@ -0,0 +1,25 @@
+import gzip
+import json
+
+
+def test_cached_figure_sent_as_is(app_module, click_graph):
+    response = click_graph("dense", dataset="mxmh")
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
+    figure = json.loads(response.data)["response"]["dense-graph"]["figure"]
+    assert figure == app_module.render_figure("mxmh", "dense")
+
+
+def test_compressed_once_per_figure(app_module, click_graph):
+    compressor = app_module.response_compressor
+    headers = {"Accept-Encoding": "gzip", "If-None-Match": "*"}
+    first = click_graph("histo", dataset="whd19", headers=headers)
+    hits = compressor.hits
+    second = click_graph("histo", dataset="whd19", headers=headers)
+    # no ETag / 304 on the callback POSTs, and the second response comes out of the cache entry
+    assert second.status_code == 200 and "ETag" not in second.headers
+    assert second.headers["Content-Encoding"] == "gzip"
+    assert compressor.hits == hits + 1
+    assert first.data == second.data
+    body = json.loads(gzip.decompress(second.data))
+    assert body["response"]["histo-graph"]["figure"] == app_module.render_figure("whd19", "histo")
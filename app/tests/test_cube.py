@@ -0,0 +1,84 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from cube import EventCube, all_columns
+from filters import EventFilterIndex, normalize_filters
+from timeindex import EventTimeIndex
+
+seasons = ["Spring", "Summer", "Autumn", "Winter"]
+
+
+def station_order(events):
+    # the table is sorted by station rank
+    return pd.unique(events["station_name"]).tolist()
+
+
+def expected(events, filters, by):
+    mask = EventFilterIndex(events, EventTimeIndex(events)).mask(filters)
+    selected = events if mask is None else events[mask]
+    return selected.assign(**{"max*days": selected["max"] * selected["days"]}).groupby(by).agg(
+        count=("max", "size"), max_min=("max", "min"), max_max=("max", "max"), days_mean=("days", "mean"),
+        mean_sum=("mean", "sum"), **{"max*days_sum": ("max*days", "sum")})
+
+
+def test_rollup_matches_groupby(events):
+    cube = EventCube(events, station_order(events), seasons)
+    for filters in [None, normalize_filters(["Lake", "Gulf"]), normalize_filters(None, [3], ["Winter"]),
+                    normalize_filters(None, None, ["Spring", "Autumn"], "1992-01-01", "1996-12-31")]:
+        for by in (["season"], ["station_name", "year"], ["domain", "station_name"]):
+            result = cube.rollup(by, filters)
+            reference = expected(events, filters, by)
+            assert list(result.columns) == all_columns
+            assert len(result) == len(reference)
+            aligned = result.reindex(reference.index)
+            for column in reference.columns:
+                assert np.allclose(aligned[column], reference[column]), (filters, by, column)
+
+
+def test_counts_are_dense(events):
+    cube = EventCube(events, station_order(events), seasons)
+    counts, (station_labels, season_labels) = cube.counts(["station_name", "season"], normalize_filters(["Lake"]))
+    assert station_labels == ["Lake"]
+    assert season_labels == seasons
+    reference = events[events["station_name"] == "Lake"].groupby("season").size()
+    assert counts.shape == (1, 4)
+    assert counts[0].tolist() == [reference.get(season, 0) for season in seasons]
+
+
+def test_years_outside_the_data_give_nothing(events):
+    cube = EventCube(events, station_order(events), seasons)
+    for filters in [normalize_filters(None, None, None, "2023-01-01"),
+                    normalize_filters(None, None, None, None, "1959-12-31"),
+                    normalize_filters(["Nowhere"])]:
+        assert cube.rollup(["domain", "station_name"], filters).empty
+        assert cube.rollup(["season"], filters, columns=["count", "max_min"]).empty
+        assert cube.counts(["station_name", "season"], filters)[0].sum() == 0
+        assert cube.total(filters)["count"] == 0
+
+
+def test_only_whole_years_are_supported():
+    assert EventCube.supports(None)
+    assert EventCube.supports({"start": "1990-01-01", "end": "1999-12-31", "seasons": ["Winter"]})
+    assert not EventCube.supports({"start": "1990-03-01"})
+    assert not EventCube.supports({"end": "1999-12-30"})
+
+
+def test_rollup_picks_columns(events):
+    cube = EventCube(events, station_order(events), seasons)
+    result = cube.rollup(["station_name", "season"], columns=["count"])
+    assert list(result.columns) == ["count"]
+    assert result["count"].sum() == len(events)
+
+
+def test_treemap_midpoint_matches_events(app_module):
+    # Saint-Laurent-IO's events of 2016 all last 0 days
+    for filters in [normalize_filters(None, None, ["Winter"], "1990-01-01", "1999-12-31"),
+                    normalize_filters(["Saint-Laurent-IO"], None, None, "2016-01-01", "2016-12-31")]:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            cmid = app_module.treemap_aggregates(filters)[2]
+            events = app_module.filtered_events(filters)
+            expected = app_module.build_event_treemap(events).layout.coloraxis.cmid
+        assert np.isfinite(cmid) and np.isclose(cmid, expected), filters
@@ -0,0 +1,28 @@
+import warnings
+
+from cube import EventCube
+from features import add_event_features, season_from_month_day
+
+
+def test_season_boundaries():
+    days = [(1, 1), (3, 19), (3, 20), (6, 20), (6, 21), (9, 21), (9, 22), (12, 20), (12, 21), (12, 31)]
+    seasons = season_from_month_day([month for month, _ in days], [day for _, day in days])
+    assert seasons.tolist() == ["Winter", "Winter", "Spring", "Spring", "Summer", "Summer", "Autumn", "Autumn",
+                                "Winter", "Winter"]
+
+
+def test_events_without_a_start_date_are_dropped(raw_events):
+    raw = raw_events.copy()
+    raw.loc[3, "date_start"] = None
+    raw.loc[7, "date_start"] = ""
+    groups = {"ups": 1, "mid": 1, "lak": 2, "est": 3, "gul": 3}
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        events = add_event_features(raw, groups, {})
+    assert len(events) == len(raw) - 2
+    assert events["date_start"].notna().all()
+    assert events["year"].min() == 1990 and events["month"].min() >= 1
+    # the cube's year axis starts with the data, not at year 0
+    cube = EventCube(events, sorted(set(raw["station_name"])), ["Winter", "Spring", "Summer", "Autumn"])
+    assert cube.labels["year"][0] == 1990
+    assert cube.count.sum() == len(events)
@@ -0,0 +1,12 @@
+import numpy as np
+import pandas as pd
+
+from figures import build_aggregated_histogram
+
+
+def test_histogram_leaves_out_missing_x():
+    df = pd.DataFrame({"x": [1, 2, 3, np.nan, np.nan, np.inf], "y": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]})
+    counts = build_aggregated_histogram(df, "x", bin_edges=[0, 1, 2, 3, 4]).data[0]
+    assert counts.y.tolist() == [1, 1, 1]
+    sums = build_aggregated_histogram(df, "x", "y", histfunc="sum", bin_edges=[0, 1, 2, 3, 4]).data[0]
+    assert sums.y.tolist() == [1.0, 2.0, 3.0]
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from filters import EventFilterIndex, describe, filter_key, normalize_filters
+from timeindex import EventTimeIndex
+
+
+def reference_mask(events, filters):
+    mask = np.ones(len(events), dtype=bool)
+    for name, column in (("stations", "station_name"), ("domains", "domain"), ("seasons", "season")):
+        if name in filters:
+            mask &= events[column].isin(filters[name]).to_numpy()
+    if "start" in filters:
+        mask &= (events["date_start"] >= pd.Timestamp(filters["start"])).to_numpy()
+    if "end" in filters:
+        mask &= (events["date_start"] < pd.Timestamp(filters["end"]) + pd.Timedelta(days=1)).to_numpy()
+    return mask
+
+
+def test_mask_matches_pandas(events):
+    index = EventFilterIndex(events, EventTimeIndex(events))
+    for filters in [
+        normalize_filters(["Lake", "Gulf"]),
+        normalize_filters(None, [1, 3], ["Winter", "Summer"]),
+        normalize_filters(["Upstream"], None, None, "1992-02-03", "1995-07-08"),
+        normalize_filters(None, None, ["Autumn"], None, "1993-12-31"),
+        normalize_filters(["Nowhere"]),
+    ]:
+        assert (index.mask(filters) == reference_mask(events, filters)).all(), filters
+    assert index.mask(None) is None
+
+
+def test_normalize_filters():
+    assert normalize_filters([], None, [], None, None) is None
+    filters = normalize_filters(["b", "a"], None, None, "1990-01-01T00:00:00", None)
+    assert filters == {"stations": ["a", "b"], "start": "1990-01-01"}
+    assert filter_key(filters) == (("start", "1990-01-01"), ("stations", ("a", "b")))
+    assert describe(None) == "1970-2022"
+    assert describe(filters) == "from 1990-01-01 (2 stations)"
+
+
+def test_malformed_dates_are_dropped():
+    assert normalize_filters(None, None, None, "1990-13-45", "not a date") is None
+    assert normalize_filters(None, None, None, "", "2001-02-03junk") == {"end": "2001-02-03"}
+
+
+def test_filtered_figures_kept_apart(app_module, click_graph):
+    for graph in app_module.graph_ids:
+        assert click_graph(graph).status_code == 200
+    warm = list(app_module.figure_cache.entries)
+    for season in ["Winter", "Spring", "Summer", "Autumn"]:
+        filters = (None, None, [season], "1990-01-01", "2002-99-99")
+        for graph in app_module.graph_ids:
+            response = click_graph(graph, clicks=None, filters=filters, changed="filter-season.value")
+            assert response.status_code == 200
+    # the dataset figures are all still there, the filtered ones went to their own cache
+    assert list(app_module.figure_cache.entries) == warm
+    assert (app_module.filtered_cache.entries.keys()
+            >= {("can", graph, (("seasons", ("Winter",)), ("start", "1990-01-01"))) for graph in app_module.graph_ids})
+
+
+def test_zero_length_events_only(app_module, click_graph):
+    # every autumn event of that day starts and ends in the same hour, so none has any weight in days
+    filters = (None, None, ["Autumn"], "2016-11-17", "2016-11-17")
+    for graph in app_module.graph_ids:
+        response = click_graph(graph, clicks=None, filters=filters, changed="filter-dates.start_date")
+        assert response.status_code == 200, graph
+    main = app_module.render_figure("can", "main", filters=app_module.normalize_filters(*filters))
+    assert np.isfinite(main["layout"]["coloraxis"]["cmid"])
@@ -0,0 +1,28 @@
+import json
+import subprocess
+import sys
+
+from metrics import MetricsRegistry
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_dead_workers_are_retired(tmp_path):
+    registry = MetricsRegistry(str(tmp_path))
+    registry.describe("requests_total", "counter", "Requests")
+    registry.describe("memory_bytes", "gauge", "Memory")
+    registry.inc("requests_total", {"graph": "histo"}, 2)
+    for pid in (dead_pid(), dead_pid()):
+        series = [["requests_total", "", [["graph", "histo"]], 3], ["memory_bytes", "", [["pid", str(pid)]], 100]]
+        (tmp_path / f"{pid}.json").write_text(json.dumps({"pid": pid, "series": series}))
+
+    expected = 'requests_total{graph="histo"} 8'
+    first = registry.render()
+    assert expected in first and "memory_bytes" not in first
+    # only the retired file is left, and a second scrape doesn't count the dead workers again
+    assert sorted(path.name for path in tmp_path.glob("*.json")) == ["retired.json"]
+    assert expected in registry.render()
@@ -0,0 +1,44 @@
+import threading
+import time
+
+import profiling
+
+
+def busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_concurrent_calls_are_all_sampled(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "profile_dir", str(tmp_path))
+    monkeypatch.setattr(profiling, "threshold", 0.05)
+
+    def run(index):
+        with profiling.profiled("update_graph", dataset="can", graph=f"graph{index}"):
+            busy_wait(0.2)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(list(tmp_path.glob("*.txt"))) == 4
+    for path in tmp_path.glob("*.folded"):
+        assert "busy_wait (test_profiling.py" in path.read_text()
+    assert profiling._recordings == {}
+
+
+def test_fast_and_nested_calls(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "profile_dir", str(tmp_path))
+    monkeypatch.setattr(profiling, "threshold", 0.5)
+    with profiling.profiled("update_graph", graph="histo"):
+        busy_wait(0.01)
+    assert list(tmp_path.iterdir()) == []
+
+    # a build inside a callback ends up in the callback's profile only
+    monkeypatch.setattr(profiling, "threshold", 0)
+    with profiling.profiled("update_graph", graph="histo"):
+        with profiling.profiled("build", graph="histo"):
+            busy_wait(0.05)
+    assert [path.name.split("-")[2] for path in tmp_path.glob("*.txt")] == ["update_graph"]
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from timeindex import EventTimeIndex
+
+
+def positions(events, mask):
+    return sorted(np.flatnonzero(mask).tolist())
+
+
+def test_between_matches_a_scan(events):
+    index = EventTimeIndex(events)
+    starts = events["date_start"]
+    window = (starts >= "1993-05-01") & (starts < "1996-01-01")
+    assert sorted(index.between("1993-05-01", "1996-01-01").tolist()) == positions(events, window)
+    assert len(index.between()) == len(events)
+    assert len(index.between("2050-01-01")) == 0
+
+
+def test_between_some_stations(events):
+    index = EventTimeIndex(events)
+    starts = events["date_start"]
+    mask = (starts >= "1995-01-01") & events["station_name"].isin(["Lake", "Gulf"]).to_numpy()
+    assert sorted(index.between("1995-01-01", stations=["Lake", "Gulf", "Nowhere"]).tolist()) == \
+        positions(events, mask)
+    assert len(index.between(stations=[])) == 0
+
+
+def test_station_rows_are_oldest_first(events):
+    index = EventTimeIndex(events)
+    rows = index.station_rows("Middle")
+    assert set(events["station_name"].iloc[rows]) == {"Middle"}
+    assert len(rows) == (events["station_name"] == "Middle").sum()
+    assert events["date_start"].iloc[rows].is_monotonic_increasing
+    assert len(index.station_rows("Nowhere")) == 0
+
+
+def test_season_and_year(events):
+    index = EventTimeIndex(events)
+    winter = events.iloc[index.season("Winter", 1994)]
+    assert (winter["date_start"] >= pd.Timestamp("1994-12-21")).all()
+    assert (winter["date_start"] < pd.Timestamp("1995-03-20")).all()
+    assert set(winter["season"]) <= {"Winter"}
+    assert set(events["year"].iloc[index.year(1997)]) == {1997}
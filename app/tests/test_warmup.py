@@ -0,0 +1,12 @@
+def test_warmup_keeps_every_figure(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "year_slider", True)
+    app_module.warmup()
+    cache = app_module.figure_cache
+    years = app_module.whd_years()
+    assert len(cache.entries) <= cache.maxsize
+    for dataset in app_module.dataset_ids:
+        for graph in app_module.graph_ids:
+            assert (dataset, graph) in cache.entries
+    for year in years:
+        for graph in app_module.animated_graphs:
+            assert ("whd", graph, year) in cache.entries
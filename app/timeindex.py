@@ -0,0 +1,92 @@
+# Sorted time index over the water level events
+# The event table is kept in station rank order, so "events between two dates" would mean
+# comparing every row. This index keeps, for every station, the row positions sorted by start
+# date, so a time window is two binary searches per station instead of a scan of the table.
+# app.py builds one per load of the event table (see the "event_index" dataset).
+
+import numpy as np
+import pandas as pd
+
+# first day (month, day) of each season and of the next one, same dates as season_starts in features.py
+season_bounds = {
+    'Spring': ((3, 20), (6, 21)),
+    'Summer': ((6, 21), (9, 22)),
+    'Autumn': ((9, 22), (12, 21)),
+    'Winter': ((12, 21), (3, 20)),
+}
+
+
+def _timestamp(value):
+    return np.datetime64(pd.Timestamp(value), "ns")
+
+
+class EventTimeIndex:
+    """
+    Row positions of the events sorted by start date, per station and overall
+    """
+
+    def __init__(self, localdf, column="date_start", station_column="station_name"):
+        times = localdf[column].to_numpy(dtype="datetime64[ns]")
+        codes, self.stations = pd.factorize(localdf[station_column], sort=False)
+
+        # all events by time, for windows over every station at once
+        self.order = np.argsort(times, kind="stable")
+        self.times = times[self.order]
+
+        # events by (station, time), each station is one contiguous run of by_station
+        self.by_station = np.lexsort((times, codes))
+        self.station_times = times[self.by_station]
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.stations))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.station_codes = {name: code for code, name in enumerate(self.stations)}
+
+        years = pd.DatetimeIndex(self.times).year
+        self.years = (int(years.min()), int(years.max())) if len(years) else (None, None)
+
+    def __len__(self):
+        return len(self.order)
+
+    def station_rows(self, station):
+        """
+        Positions of a station's events, oldest first
+        """
+        code = self.station_codes.get(station)
+        if code is None:
+            return np.empty(0, dtype=np.intp)
+        return self.by_station[self.offsets[code]:self.offsets[code + 1]]
+
+    def between(self, start=None, end=None, stations=None):
+        """
+        Positions of the events starting in [start, end), optionally only for some stations
+        start and end are anything pd.Timestamp takes, None leaves that side open
+        """
+        if stations is None:
+            lo, hi = self._window(self.times, start, end)
+            return self.order[lo:hi]
+        parts = []
+        for station in stations:
+            code = self.station_codes.get(station)
+            if code is None:
+                continue
+            first, last = self.offsets[code], self.offsets[code + 1]
+            lo, hi = self._window(self.station_times[first:last], start, end)
+            parts.append(self.by_station[first + lo:first + hi])
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.intp)
+
+    def year(self, year, stations=None):
+        return self.between(f"{year}-01-01", f"{year + 1}-01-01", stations)
+
+    def season(self, season, year, stations=None):
+        """
+        Events of one season of one year, winter being the one that starts in December of that year
+        """
+        (start_month, start_day), (end_month, end_day) = season_bounds[season]
+        end_year = year + 1 if season == 'Winter' else year
+        return self.between(f"{year}-{start_month:02d}-{start_day:02d}",
+                            f"{end_year}-{end_month:02d}-{end_day:02d}", stations)
+
+    @staticmethod
+    def _window(times, start, end):
+        lo = 0 if start is None else np.searchsorted(times, _timestamp(start), side="left")
+        hi = len(times) if end is None else np.searchsorted(times, _timestamp(end), side="left")
+        return lo, max(lo, hi)